@@ -0,0 +1,82 @@
+### DISCLAIMER
+# USE THE SCRIPT AT YOUR OWN RISK
+# ALWAYS VERIFY RESULTS
+
+import os, sys
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+# import custom lib
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "lib"))
+
+from conf_parser import iter_stanzas
+
+__name__ = "bench_conf_parser.py"
+__author__ = "Michel de Jong"
+
+def write_savedsearches(path, size_mb):
+    """Write a synthetic savedsearches.conf of about size_mb megabytes."""
+    target = size_mb * 1024 * 1024
+    written = 0
+    count = 0
+    with open(path, 'w', encoding='utf-8') as file:
+        while written < target:
+            stanza = (
+                f"# Generated search {count}\n"
+                f"[Generated Search {count}]\n"
+                f"search = index=main sourcetype=generated_{count % 50} \\\n"
+                f"| eval bucket=floor(_time/300) \\\n"
+                f"| stats count by host, source, bucket\n"
+                f"cron_schedule = */{(count % 59) + 1} * * * *\n"
+                f"enableSched = 1\n"
+                f"dispatch.earliest_time = -24h@h\n"
+                f"dispatch.latest_time = now\n"
+                f"action.email = 1\n"
+                f"action.email.to = soc-team-{count % 10}@example.com\n"
+                f"action.email.subject = Alert for generated search {count}\n"
+                f"alert.suppress = 0\n"
+                f"\n"
+            )
+            file.write(stanza)
+            written += len(stanza)
+            count += 1
+    return count
+
+def run(size_mb):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "savedsearches.conf")
+        generated = write_savedsearches(path, size_mb)
+        file_size = os.path.getsize(path) / (1024 * 1024)
+
+        start = time.perf_counter()
+        stanzas = 0
+        settings = 0
+        for _, params in iter_stanzas(path):
+            stanzas += 1
+            settings += len(params)
+        elapsed = time.perf_counter() - start
+
+        # Separate pass, as tracing allocations slows down parsing
+        tracemalloc.start()
+        for _ in iter_stanzas(path):
+            pass
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        if stanzas != generated:
+            print(f"Parsed {stanzas} stanzas, expected {generated}")
+            sys.exit(1)
+
+        print(f"File size:        {file_size:.1f} MB")
+        print(f"Stanzas:          {stanzas} ({settings} settings)")
+        print(f"Parse time:       {elapsed:.2f} s")
+        print(f"Throughput:       {file_size / elapsed:.1f} MB/s | {stanzas / elapsed:.0f} stanzas/s")
+        print(f"Peak memory:      {peak / 1024:.0f} KB")
+
+if __name__ == "bench_conf_parser.py":
+    parser = argparse.ArgumentParser(description="Measure the throughput of the .conf parser on a synthetic savedsearches.conf")
+    parser.add_argument("-size", type=int, default=50, help="Size of the generated savedsearches.conf in MB (default 50)")
+    args = parser.parse_args()
+    run(args.size)
@@ -0,0 +1,149 @@
+### DISCLAIMER
+# USE THE SCRIPT AT YOUR OWN RISK
+# ALWAYS VERIFY RESULTS
+
+import os, sys
+import time
+import socket
+import argparse
+import tempfile
+import contextlib
+import subprocess
+
+# import custom lib
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "lib"))
+
+import api_caller
+import rest_update_savedsearches
+import rest_bulk_create
+from session_pool import close_sessions
+from script_logger import flush_logs
+from run_metrics import all_durations
+
+__name__ = "bench_end_to_end.py"
+__author__ = "Michel de Jong"
+
+APPS = 10
+
+def write_apps(location, prefix, stanzas, layout):
+    """Write APPS apps with stanzas saved searches in total. layout is 'default' (enable) or 'local' (create)."""
+    per_app = max(1, stanzas // APPS)
+    written = 0
+    for app in range(APPS):
+        count = min(per_app, stanzas - written) if app < APPS - 1 else stanzas - written
+        if count <= 0:
+            break
+        conf_dir = os.path.join(location, f"{prefix}_app{app}", layout)
+        os.makedirs(conf_dir)
+        with open(os.path.join(conf_dir, "savedsearches.conf"), 'w', encoding='utf-8') as file:
+            for index in range(count):
+                file.write(
+                    f"[{prefix} search {app}-{index}]\n"
+                    f"search = index=main sourcetype=bench_{index % 20} | stats count by host\n"
+                    f"cron_schedule = */{(index % 59) + 1} * * * *\n"
+                    f"enableSched = 1\n"
+                    f"disabled = {index % 2}\n"
+                    f"\n"
+                )
+        written += count
+    return written
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def start_mock_server(args):
+    """Start the mock server in its own process, so it does not compete with the client for the GIL."""
+    port = free_port()
+    command = [
+        sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "mock_splunk_server.py"),
+        "-port", str(port), "-latency", str(args.latency), "-jitter", str(args.jitter),
+        "-error-rate", str(args.error_rate), "-rate-limit", str(args.rate_limit),
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=0.5).close()
+            return process, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    print("The mock server did not start")
+    sys.exit(1)
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def run_flow(mode, location, api_url, args):
+    """Run the enable or create flow against the mock server. Returns (calls, failures, elapsed, durations)."""
+    run_args = argparse.Namespace(
+        debug=False, dummy=False, async_engine=args.async_engine, diff=False, resume=False,
+        enable=(mode == "enable"), create=(mode == "create"), plan=None, apply=None,
+    )
+    config = lambda: (api_url, location, "benchmark", args.max_api_calls)
+    rest_update_savedsearches.get_config = config
+    rest_bulk_create.get_config = config
+    api_caller.reset_counters()
+
+    start = time.perf_counter()
+    # The flows print a progress line per API call
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        if mode == "enable":
+            rest_update_savedsearches.rest_bulk_update_savedsearches(run_args)
+        else:
+            rest_bulk_create.rest_bulk_create(run_args)
+    elapsed = time.perf_counter() - start
+    flush_logs()
+    close_sessions()
+    if api_caller.api_calls_made == 0:
+        # The flows log their errors instead of raising them, a run without calls is a broken flow
+        print(f"The {mode} flow made no API calls, see the error log in {os.getcwd()}")
+        sys.exit(1)
+    return api_caller.api_calls_made, api_caller.failure_counter, elapsed, all_durations()
+
+def run(args):
+    sizes = [int(size) for size in args.sizes.split(",")]
+    modes = ["enable", "create"] if args.mode == "both" else [args.mode]
+    process, api_url = start_mock_server(args)
+    work_dir = os.getcwd()
+
+    try:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            # Logs, the parse cache and the journal of the runs end up in the temporary directory
+            os.chdir(temp_dir)
+            engine = "asyncio" if args.async_engine else f"threads ({args.max_api_calls})"
+            print(f"Mock server: {api_url} | latency {args.latency}s | error rate {args.error_rate} | rate limit {args.rate_limit or 'none'} | engine {engine}")
+            print(f"{'Mode':<8} {'Stanzas':>8} {'Calls':>8} {'Failed':>7} {'Time (s)':>9} {'Calls/s':>9} {'p50 (ms)':>9} {'p95 (ms)':>9}")
+            for mode in modes:
+                for size in sizes:
+                    location = os.path.join(temp_dir, f"{mode}_{size}")
+                    os.makedirs(location)
+                    # Unique app names per run, the mock server keeps the created objects
+                    stanzas = write_apps(location, f"{mode}{size}", size, "default" if mode == "enable" else "local")
+                    calls, failures, elapsed, durations = run_flow(mode, location, api_url, args)
+                    print(
+                        f"{mode:<8} {stanzas:>8} {calls:>8} {failures:>7} {elapsed:>9.2f} {calls / elapsed:>9.0f} "
+                        f"{percentile(durations, 0.50) * 1000:>9.1f} {percentile(durations, 0.95) * 1000:>9.1f}"
+                    )
+            os.chdir(work_dir)
+    finally:
+        process.terminate()
+        process.wait()
+
+if __name__ == "bench_end_to_end.py":
+    parser = argparse.ArgumentParser(description="Measure the end-to-end throughput of the enable and create flows against the local mock Splunk REST server")
+    parser.add_argument("-sizes", default="100,1000,10000", help="Comma separated numbers of stanzas (default 100,1000,10000)")
+    parser.add_argument("-mode", choices=["enable", "create", "both"], default="both", help="Flow to measure (default both)")
+    parser.add_argument("-async", dest="async_engine", action="store_true", help="Use the asyncio engine (requires aiohttp)")
+    parser.add_argument("-max-api-calls", dest="max_api_calls", type=int, default=100, help="Parallel API calls and calls per second (default 100)")
+    parser.add_argument("-latency", type=float, default=0.01, help="Latency per request of the mock server in seconds (default 0.01)")
+    parser.add_argument("-jitter", type=float, default=0.005, help="Random variation of the latency in seconds (default 0.005)")
+    parser.add_argument("-error-rate", dest="error_rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument("-rate-limit", dest="rate_limit", type=int, default=0, help="Requests per second before the mock server answers with 429 (0 = no limit)")
+    args = parser.parse_args()
+    run(args)
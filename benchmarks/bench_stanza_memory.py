@@ -0,0 +1,96 @@
+### DISCLAIMER
+# USE THE SCRIPT AT YOUR OWN RISK
+# ALWAYS VERIFY RESULTS
+
+import os, sys
+import gc
+import time
+import argparse
+import tempfile
+import tracemalloc
+
+# import custom lib
+sys.path.append(os.path.join(os.path.dirname(__file__), "..", "lib"))
+
+from stanza_model import compact_stanzas, reset_stanza_pools
+from rest_update_savedsearches import read_searches
+
+__name__ = "bench_stanza_memory.py"
+__author__ = "Michel de Jong"
+
+def write_savedsearches(path, stanzas):
+    """Write a synthetic savedsearches.conf with realistic, partly repeating settings."""
+    with open(path, 'w', encoding='utf-8') as file:
+        for count in range(stanzas):
+            file.write(
+                f"[Generated Search {count}]\n"
+                f"search = index=main sourcetype=generated_{count % 50} user=user_{count} | stats count by host, source | where count > {count % 100}\n"
+                f"cron_schedule = */{(count % 59) + 1} * * * *\n"
+                f"enableSched = 1\n"
+                f"disabled = {count % 2}\n"
+                f"dispatch.earliest_time = -24h@h\n"
+                f"dispatch.latest_time = now\n"
+                f"alert.suppress = 0\n"
+                f"alert.track = 1\n"
+                f"counttype = number of events\n"
+                f"relation = greater than\n"
+                f"quantity = 0\n"
+            )
+            if count % 3 == 0:
+                file.write(
+                    f"action.email = 1\n"
+                    f"action.email.to = soc-team-{count % 10}@example.com\n"
+                    f"action.email.subject = Alert for generated search {count}\n"
+                    f"action.email.sendresults = 1\n"
+                )
+            file.write("\n")
+
+def measure(build):
+    """Return (result, bytes allocated and still in use, seconds) of build()."""
+    gc.collect()
+    tracemalloc.start()
+    st = time.perf_counter()
+    result = build()
+    elapsed = time.perf_counter() - st
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, current, elapsed
+
+def read_all(data):
+    """Read every setting of every stanza, as the call preparation does."""
+    st = time.perf_counter()
+    for stanza, params in data.items():
+        payload = {"name": stanza, **params}
+        params.get("disabled")
+    return time.perf_counter() - st
+
+def run(args):
+    print(f"{'Stanzas':>8} {'Dicts (MB)':>11} {'Compact (MB)':>13} {'Saved':>7} {'Read dicts (s)':>15} {'Read compact (s)':>17}")
+    for size in [int(size) for size in args.sizes.split(",")]:
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "savedsearches.conf")
+            write_savedsearches(path, size)
+
+            dicts, dict_bytes, _ = measure(lambda: read_searches(path))
+            read_dicts = read_all(dicts)
+            del dicts
+
+            reset_stanza_pools()
+            compact, compact_bytes, _ = measure(lambda: compact_stanzas(read_searches(path)))
+            read_compact = read_all(compact)
+            if len(compact) != size:
+                print(f"Parsed {len(compact)} stanzas, expected {size}")
+                sys.exit(1)
+            del compact
+
+            print(
+                f"{size:>8} {dict_bytes / 1024 / 1024:>11.1f} {compact_bytes / 1024 / 1024:>13.1f} "
+                f"{(1 - compact_bytes / dict_bytes) * 100:>6.0f}% {read_dicts:>15.3f} {read_compact:>17.3f}"
+            )
+
+if __name__ == "bench_stanza_memory.py":
+    parser = argparse.ArgumentParser(description="Compare the memory use of parsed saved searches as dictionaries and as compact stanzas")
+    parser.add_argument("-sizes", default="10000,50000", help="Comma separated numbers of stanzas (default 10000,50000)")
+    args = parser.parse_args()
+    run(args)
@@ -0,0 +1,85 @@
+### DISCLAIMER
+# USE THE SCRIPT AT YOUR OWN RISK
+# ALWAYS VERIFY RESULTS
+
+import os, sys
+import time
+import argparse
+import statistics
+import subprocess
+
+__name__ = "bench_startup.py"
+__author__ = "Michel de Jong"
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "splunkcloud_tools.py")
+
+# Modules that are only needed once a script is selected, and must not be loaded at startup
+HEAVY_MODULES = ("requests", "urllib3", "concurrent.futures", "multiprocessing", "sqlite3", "aiohttp", "api_caller", "rest_bulk_create", "rest_update_savedsearches", "disabling_savedsearches")
+
+def parse_importtime(output):
+    """Return {module: cumulative microseconds} from the -X importtime output."""
+    modules = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = int(cumulative)
+    return modules
+
+def top_level_total(output):
+    """Sum the cumulative import time of the top-level imports, excluding the interpreter startup (site)."""
+    total = 0
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Top-level imports are indented by a single space
+        if name.startswith(" ") and not name.startswith("  ") and name.strip() != "site":
+            total += int(cumulative)
+    return total
+
+def run(args):
+    wall_times = []
+    import_times = []
+    modules = {}
+    for _ in range(args.runs):
+        st = time.perf_counter()
+        result = subprocess.run([sys.executable, "-X", "importtime", SCRIPT, "-h"], capture_output=True, text=True)
+        wall_times.append(time.perf_counter() - st)
+        if result.returncode != 0:
+            print(result.stderr)
+            sys.exit(1)
+        import_times.append(top_level_total(result.stderr) / 1000)
+        modules = parse_importtime(result.stderr)
+
+    baseline = []
+    for _ in range(args.runs):
+        st = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "pass"], capture_output=True)
+        baseline.append(time.perf_counter() - st)
+
+    print(f"Startup (splunkcloud_tools.py -h): median {statistics.median(wall_times) * 1000:.0f} ms | min {min(wall_times) * 1000:.0f} ms over {args.runs} runs")
+    print(f"Bare interpreter:                  median {statistics.median(baseline) * 1000:.0f} ms")
+    print(f"Imports of the script:             median {statistics.median(import_times):.1f} ms")
+    print("Slowest imports (cumulative):")
+    for name, cumulative in sorted(modules.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"  {cumulative / 1000:>8.1f} ms  {name}")
+
+    failed = False
+    loaded = [module for module in HEAVY_MODULES if module in modules]
+    if loaded:
+        print(f"Modules loaded at startup that should be lazy: {', '.join(loaded)}")
+        failed = True
+    if args.max_ms and statistics.median(import_times) > args.max_ms:
+        print(f"Import time exceeds the limit of {args.max_ms} ms")
+        failed = True
+    if failed:
+        sys.exit(1)
+
+if __name__ == "bench_startup.py":
+    parser = argparse.ArgumentParser(description="Measure the cold start of splunkcloud_tools.py with -X importtime and fail when startup regresses")
+    parser.add_argument("-runs", type=int, default=10, help="Number of runs (default 10)")
+    parser.add_argument("-top", type=int, default=10, help="Number of slowest imports to list (default 10)")
+    parser.add_argument("-max-ms", dest="max_ms", type=float, default=0, help="Fail when the median import time of the script exceeds this number of milliseconds")
+    args = parser.parse_args()
+    run(args)
@@ -0,0 +1,176 @@
+### DISCLAIMER
+# USE THE SCRIPT AT YOUR OWN RISK
+# ALWAYS VERIFY RESULTS
+
+import os, re, sys
+import json
+import time
+import random
+import argparse
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+__name__ = "mock_splunk_server.py"
+__author__ = "Michel de Jong"
+
+# servicesNS/<owner>/<app>/<endpoint>[/<name>[/acl]]
+ENDPOINT_PATTERN = re.compile(
+    r'^/servicesNS/(?P<owner>[^/]+)/(?P<app>[^/]+)/'
+    r'(?P<endpoint>configs/conf-[^/]+|data/ui/[^/]+|data/props/[^/]+|data/transforms/[^/]+|datamodel/model)'
+    r'(?:/(?P<name>[^/]+))?(?P<acl>/acl)?/?$'
+)
+
+class MockSplunk:
+    """In-memory stand-in for the Splunk management API with configurable latency, errors and throttling."""
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.objects = {}
+        self.requests = 0
+        self.throttled = 0
+        self.lock = threading.Lock()
+        self.window_start = time.monotonic()
+        self.window_count = 0
+
+    def throttle(self):
+        """Return True when the request exceeds the rate limit of the current second."""
+        if not self.rate_limit:
+            return False
+        with self.lock:
+            now = time.monotonic()
+            if now - self.window_start >= 1.0:
+                self.window_start = now
+                self.window_count = 0
+            self.window_count += 1
+            if self.window_count > self.rate_limit:
+                self.throttled += 1
+                return True
+            return False
+
+    def delay(self):
+        if self.latency or self.jitter:
+            time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+    def handle_post(self, app, endpoint, name, acl, form):
+        with self.lock:
+            objects = self.objects.setdefault((app, endpoint), {})
+            if acl:
+                if name not in objects:
+                    return 404, {"messages": [{"type": "ERROR", "text": f"Could not find object id={name}"}]}
+                objects[name]["acl"] = {"owner": form.get("owner", "nobody"), "sharing": form.get("sharing", "app"), "app": app}
+                return 200, {"entry": [{"name": name, "acl": objects[name]["acl"]}]}
+            if name is None:
+                name = form.pop("name", None)
+                if not name:
+                    return 400, {"messages": [{"type": "ERROR", "text": "Missing name"}]}
+                if name in objects:
+                    return 409, {"messages": [{"type": "ERROR", "text": f"An object with name={name} already exists"}]}
+                objects[name] = {"content": dict(form), "acl": {"owner": "nobody", "sharing": "app", "app": app}}
+                return 201, {"entry": [{"name": name, "content": objects[name]["content"]}]}
+            if name not in objects:
+                if endpoint != "configs/conf-savedsearches":
+                    return 404, {"messages": [{"type": "ERROR", "text": f"Could not find object id={name}"}]}
+                # Saved searches installed with the app exist without being created through the API
+                objects[name] = {"content": {}, "acl": {"owner": "nobody", "sharing": "app", "app": app}}
+            objects[name]["content"].update(form)
+            return 200, {"entry": [{"name": name, "content": objects[name]["content"]}]}
+
+    def handle_list(self, app, endpoint, query):
+        count = int(query.get("count", ["30"])[0])
+        offset = int(query.get("offset", ["0"])[0])
+        with self.lock:
+            entries = [
+                {"name": name, "acl": item["acl"], "content": {"disabled": item["content"].get("disabled", "0") in ("1", "true")}}
+                for name, item in sorted(self.objects.get((app, endpoint), {}).items())
+            ]
+        total = len(entries)
+        page = entries[offset:] if count == 0 else entries[offset:offset + count]
+        return 200, {"entry": page, "paging": {"total": total, "offset": offset, "perPage": count}}
+
+def make_handler(splunk):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def reply(self, status, body, headers=None):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def route(self, method):
+            length = int(self.headers.get("Content-Length", 0) or 0)
+            body = self.rfile.read(length).decode("utf-8") if length else ""
+            with splunk.lock:
+                splunk.requests += 1
+
+            if not self.headers.get("Authorization"):
+                return self.reply(401, {"messages": [{"type": "ERROR", "text": "Unauthorized"}]})
+            if splunk.throttle():
+                return self.reply(429, {"messages": [{"type": "ERROR", "text": "Too many requests"}]}, {"Retry-After": "1"})
+            splunk.delay()
+            if splunk.error_rate and random.random() < splunk.error_rate:
+                return self.reply(503, {"messages": [{"type": "ERROR", "text": "Service unavailable"}]})
+
+            parsed = urllib.parse.urlsplit(self.path)
+            match = ENDPOINT_PATTERN.match(parsed.path)
+            if not match:
+                return self.reply(404, {"messages": [{"type": "ERROR", "text": f"Unknown endpoint {parsed.path}"}]})
+            app = urllib.parse.unquote(match.group("app"))
+            endpoint = match.group("endpoint")
+            name = match.group("name")
+            if name is not None:
+                # Slashes in object names are double encoded
+                name = urllib.parse.unquote(urllib.parse.unquote(name))
+
+            if method == "GET" and name is None:
+                status, response = splunk.handle_list(app, endpoint, urllib.parse.parse_qs(parsed.query))
+            elif method == "POST":
+                form = {key: values[-1] for key, values in urllib.parse.parse_qs(body, keep_blank_values=True).items()}
+                status, response = splunk.handle_post(app, endpoint, name, bool(match.group("acl")), form)
+            else:
+                status, response = 405, {"messages": [{"type": "ERROR", "text": "Method not allowed"}]}
+            self.reply(status, response)
+
+        def do_GET(self):
+            self.route("GET")
+
+        def do_POST(self):
+            self.route("POST")
+
+        def log_message(self, *args):
+            pass
+
+    return Handler
+
+def start_server(port=0, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit=0):
+    """Start the mock server in a background thread. Returns (server, splunk)."""
+    splunk = MockSplunk(latency, jitter, error_rate, rate_limit)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(splunk))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, splunk
+
+if __name__ == "mock_splunk_server.py":
+    parser = argparse.ArgumentParser(description="Local stand-in for the Splunk management API (servicesNS/nobody/<app>/configs/conf-*, data/ui/views and the ACL endpoints)")
+    parser.add_argument("-port", type=int, default=8089, help="Port to listen on (default 8089)")
+    parser.add_argument("-latency", type=float, default=0.0, help="Latency per request in seconds")
+    parser.add_argument("-jitter", type=float, default=0.0, help="Random variation of the latency in seconds")
+    parser.add_argument("-error-rate", dest="error_rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument("-rate-limit", dest="rate_limit", type=int, default=0, help="Requests per second before answering with 429 (0 = no limit)")
+    args = parser.parse_args()
+
+    server, splunk = start_server(args.port, args.latency, args.jitter, args.error_rate, args.rate_limit)
+    print(f"Mock Splunk REST API listening on http://127.0.0.1:{server.server_address[1]}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print(f"\nRequests: {splunk.requests} | Throttled: {splunk.throttled}")
+        server.shutdown()
@@ -4,17 +4,24 @@
 
 import os, re, sys
 import datetime, time
-import urllib.parse, urllib3
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+import random
+import urllib.parse
 import requests
 import threading
+from concurrent.futures import ThreadPoolExecutor
 
 # import custom lib
 sys.path.append(os.path.join(os.path.dirname(__file__), "lib"))
 
 from script_logger import log_message
 from meta_parser import prepare_api_calls
-from utils import endpoint_mapping
+from utils import read_config_value, target_of, call_data
+from object_registry import object_url, encode_object_name
+from call_journal import get_journal
+from session_pool import configure_session_pool, get_session, connection_stats
+from rate_limiter import configure_rate_limiter, get_rate_limiter
+from circuit_breaker import configure_circuit_breakers, get_circuit_breaker
+from run_metrics import record_call
 
 __name__ = "api_caller.py"
 __author__ = "Michel de Jong"
@@ -25,50 +32,183 @@ success_counter = 0
 failure_counter = 0
 total_time = 0
 api_calls_made = 0
+# Counters per target (scheme://host:port) when calling several search heads or stacks in one run
+target_counters = {}
 
-# Lock for synchronizing log writing
+# Lock for the counters and the console output. Log lines are written by the background log writer
 log_lock = threading.Lock()
 
-def make_api_call(api_url, app_name, stanza_name, headers, data):
+SUCCESS_STATUS_CODES = {200, 201}
+
+# Follow-up calls (ACL updates) are retried while the created object is not visible yet
+NOT_FOUND_RETRIES = 3
+NOT_FOUND_DELAY = 0.5
+
+# Status codes of transient errors that are retried (0: no response received, e.g. a connection reset)
+NO_RESPONSE = 0
+RETRYABLE_STATUS_CODES = {NO_RESPONSE, 429, 500, 502, 503, 504}
+# Results of an attempt that may have been applied by the server anyway (e.g. a timeout after the object was created)
+MAYBE_APPLIED_STATUS_CODES = {NO_RESPONSE, 500, 502, 503, 504}
+# Returned by a create call when the object already exists
+CONFLICT_STATUS_CODE = 409
+
+# Retries of transient errors, with exponential backoff and jitter (configs.json: max_retries, retry_base_delay, retry_max_delay)
+max_retries = 3
+retry_base_delay = 1.0
+retry_max_delay = 30.0
+# Seconds to wait for a response (configs.json: api_timeout)
+request_timeout = 60
+
+def count_target(api_url, success, timetaken=0.0):
+    # Called with log_lock held
+    counters = target_counters.setdefault(target_of(api_url), {"success": 0, "failure": 0, "calls": 0, "time": 0.0})
+    counters["calls"] += 1
+    counters["time"] += timetaken
+    counters["success" if success else "failure"] += 1
+
+def record_response(api_url, app_name, stanza_name, status_code, response_text, timetaken):
+    """Count the result of an API call and log it. Shared by the thread and asyncio engines."""
+    global success_counter, failure_counter, total_time, api_calls_made
+
+    with log_lock:
+        total_time += timetaken
+        api_calls_made += 1
+        if status_code in SUCCESS_STATUS_CODES:
+            success_counter += 1
+        else:
+            failure_counter += 1
+        count_target(api_url, status_code in SUCCESS_STATUS_CODES, timetaken)
+
+        # Calculate and display counters with average time
+        avg_time = total_time / api_calls_made if api_calls_made > 0 else 0
+        # Print the current counters and average time on the same line
+        print(f"\rAPI Calls - Success: {success_counter} | Failure: {failure_counter} (see error.log)| Avg Time: {avg_time:.4f}s", end="")
+        print("\n")
+
+    if status_code in SUCCESS_STATUS_CODES:
+        log_message(logfile, f"API call successful for {api_url}, '{stanza_name}' in {app_name}", level="info")
+    else:
+        log_message(logfile, f"API call failed for {api_url}, '{stanza_name}' in {app_name}. Status Code: {status_code}", level="error")
+        log_message(logfile, f"Response Content: {response_text}", level="error")
+
+def reset_counters():
+    """Reset the counters before a new run in the same process."""
     global success_counter, failure_counter, total_time, api_calls_made
+    with log_lock:
+        success_counter = 0
+        failure_counter = 0
+        total_time = 0
+        api_calls_made = 0
+        target_counters.clear()
+
+def record_failure(api_url, app_name, stanza_name, error, network=True):
+    """Count an API call that did not get a response."""
+    global failure_counter, api_calls_made
+
+    reason = "a network error" if network else "an unexpected error"
+    with log_lock:
+        failure_counter += 1
+        api_calls_made += 1
+        count_target(api_url, False)
+        print(f"#{api_calls_made} | API call failed due to {reason}: {error}")
+    if network:
+        log_message(logfile, f"API call failed for {api_url}, '{stanza_name}' in {app_name}. Network error: {error}", level="error")
+    else:
+        log_message(logfile, f"API call failed for {api_url}, '{stanza_name}' in {app_name}. Unexpected error: {error}", level="error")
+
+def admit_call(api_url):
+    """
+    Ask the circuit breaker of the endpoint to send a call. Returns (breaker, wait): breaker is None when the endpoint is down,
+    and wait > 0 while the endpoint is paused, the call is then sent again after wait seconds without holding a worker.
+    """
+    breaker = get_circuit_breaker(api_url)
+    allowed, wait = breaker.before_call()
+    return (breaker if allowed else None), wait
+
+def accepted_status(api_url, app_name, stanza_name, status_code, maybe_applied):
+    """
+    Return 201 for a 409 of a call whose earlier attempt may have been applied: the earlier attempt created
+    the object, so the call succeeded and its follow-up call (the ACL update) still runs.
+    """
+    if status_code == CONFLICT_STATUS_CODE and maybe_applied:
+        log_message(logfile, f"API call for {api_url}, '{stanza_name}' in {app_name} returned {status_code} after an attempt without a clear result, the object was created by that attempt", level="info")
+        return 201
+    return status_code
+
+def make_api_call(api_url, app_name, stanza_name, headers, data, retry_statuses=(), maybe_applied=False, breaker=None):
+    """
+    Send the API call and return the status code, or None when the call failed without a response.
+    Responses with a status code in retry_statuses are not counted, as the call will be retried.
+    NO_RESPONSE (0) is returned for a network error when it is in retry_statuses.
+    maybe_applied: an earlier attempt of the call may have been applied, a 409 counts as created.
+    breaker: the circuit breaker that admitted the call (admit_call), None when the endpoint is down.
+    """
+    if breaker is None:
+        record_failure(api_url, app_name, stanza_name, "the circuit breaker is open, the endpoint keeps failing", network=True)
+        return None
 
     try:
+        limiter = get_rate_limiter(api_url)
+        limiter.acquire()
         st = datetime.datetime.now()
-        response = requests.post(api_url, headers=headers, data=data, verify=False)
+        response = get_session(api_url).post(api_url, headers=headers, data=data, verify=False, timeout=request_timeout)
         et = datetime.datetime.now()
         timetaken = (et - st).total_seconds()
+        record_call(api_url, response.status_code, timetaken)
+        breaker.on_result(response.status_code)
+        if limiter.on_response(response.status_code, response.headers.get("Retry-After")):
+            log_message(logfile, f"Throttled by {api_url} (Status Code: {response.status_code}), lowering the call rate", level="info")
 
-        with log_lock:
-            total_time += timetaken
-            api_calls_made += 1
-        
-            if response.status_code in {200, 201}:
-                success_counter += 1
-                log_message(logfile, f"API call successful for {api_url}, '{stanza_name}' in {app_name}", level="info")
-            else:
-                failure_counter += 1
-                log_message(logfile, f"API call failed for {api_url}, '{stanza_name}' in {app_name}. Status Code: {response.status_code}", level="error")
-                log_message(logfile, f"Response Content: {response.text}", level="error")
+        if response.status_code in retry_statuses:
+            log_message(logfile, f"API call for {api_url}, '{stanza_name}' in {app_name} returned {response.status_code}, retrying", level="info")
+            return response.status_code
 
-        # Calculate and display counters with average time
-        with log_lock:
-            avg_time = total_time / api_calls_made if api_calls_made > 0 else 0
-            # Print the current counters and average time on the same line
-            print(f"\rAPI Calls - Success: {success_counter} | Failure: {failure_counter} (see error.log)| Avg Time: {avg_time:.4f}s", end="")
-            print("\n")
+        status_code = accepted_status(api_url, app_name, stanza_name, response.status_code, maybe_applied)
+        record_response(api_url, app_name, stanza_name, status_code, response.text, timetaken)
+        return status_code
 
     except requests.exceptions.RequestException as e:
-        with log_lock:
-            failure_counter += 1
-            api_calls_made += 1
-            print(f"#{api_calls_made} | API call failed due to a network error: {e}")
-            log_message(logfile, f"API call failed for {api_url}, '{stanza_name}' in {app_name}. Network error: {e}", level="error")
+        record_call(api_url, None, None)
+        breaker.on_result(NO_RESPONSE)
+        if NO_RESPONSE in retry_statuses:
+            log_message(logfile, f"API call for {api_url}, '{stanza_name}' in {app_name} failed with a network error, retrying: {e}", level="info")
+            return NO_RESPONSE
+        record_failure(api_url, app_name, stanza_name, e, network=True)
     except Exception as e:
-        with log_lock:
-            failure_counter += 1
-            api_calls_made += 1
-            print(f"#{api_calls_made} | API call failed due to an unexpected error: {e}")
-            log_message(logfile, f"API call failed for {api_url}, '{stanza_name}' in {app_name}. Unexpected error: {e}", level="error")
+        record_call(api_url, None, None)
+        breaker.on_result(None)
+        record_failure(api_url, app_name, stanza_name, e, network=False)
+    return None
+
+def setup_api_caller(max_api_calls):
+    """Prepare the shared connection pools and rate limiters before the first API call."""
+    configure_session_pool(max_api_calls)
+    configure_rate_limiter(max_api_calls, read_config_value("burst_api_calls", 1))
+    configure_retries(read_config_value("max_retries", 3), read_config_value("retry_base_delay", 1.0), read_config_value("retry_max_delay", 30.0), read_config_value("api_timeout", 60))
+    configure_circuit_breakers(read_config_value("circuit_breaker_failures", 5), read_config_value("circuit_breaker_cooldown", 10.0))
+
+def configure_retries(retries=3, base_delay=1.0, max_delay=30.0, timeout=60):
+    global max_retries, retry_base_delay, retry_max_delay, request_timeout
+    max_retries = max(0, int(retries))
+    retry_base_delay = float(base_delay)
+    retry_max_delay = float(max_delay)
+    request_timeout = timeout
+
+def report_connection_stats():
+    opened, reused = connection_stats()
+    print(f"Connections - Opened: {opened} | Reused: {reused}")
+    log_message(logfile, f"Connections opened: {opened}, connections reused: {reused}", level="info")
+
+def report_target_stats():
+    """Print the counters per target, when more than one target was called."""
+    with log_lock:
+        counters = {target: dict(values) for target, values in target_counters.items()}
+    if len(counters) < 2:
+        return
+    for target, values in sorted(counters.items()):
+        avg_time = values["time"] / values["calls"] if values["calls"] else 0
+        print(f"{target} - Success: {values['success']} | Failure: {values['failure']} | Avg Time: {avg_time:.4f}s")
+        log_message(logfile, f"{target}: {values['success']} successful and {values['failure']} failed API calls, average time {avg_time:.4f}s", level="info")
 
 def dummy_api_call(api_url, app_name, stanza_name, headers, data):
     global success_counter, failure_counter, total_time, api_calls_made
@@ -76,55 +216,194 @@ def dummy_api_call(api_url, app_name, stanza_name, headers, data):
         success_counter += 1
         print(f"\rDUMMY API Calls - Success: {success_counter} | Failure: {failure_counter} (see error.log)", end="")
         print("\n")
-        log_message(logfile, f"Dummy run successful for {stanza_name} in {app_name}. API-url: {api_url}", level="dummy")
+    log_message(logfile, f"Dummy run successful for {stanza_name} in {app_name}. API-url: {api_url}", level="dummy")
+    return 200
 
-def build_create_url(api_url_base, token, args, object_name, stanza, params, app_name, tag):
-   # Encode stanza name
-    encoded_stanza = urllib.parse.quote(stanza)
-    encoded_stanza = encoded_stanza.replace("/", "%252F")
-    
+def prepare_create_call(api_url_base, token, args, object_name, stanza, params, app_name, tag, acl=None):
+    """
+    Build the create call for an object, with the ACL update (acl, from the .meta files of the app) as follow-up call.
+    Without acl the object keeps the ACL the create call gives it. Returns None for unknown object types.
+    """
     # Determine the API endpoint
-    api_endpoint = endpoint_mapping().get(tag, None)
+    api_call = object_url(tag, api_url_base, app_name)
+    if api_call is None:
+        log_message(logfile, f"Skipping '{stanza}' from {object_name} in {app_name}: no API endpoint for object type '{tag}'", level="error")
+        return None
 
-    api_call = f"{api_url_base}/servicesNS/nobody/{app_name}/{api_endpoint}"
     headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-    data = params  # Use all savedsearch dynamically
-    api_call_acl = f"{api_url_base}/servicesNS/nobody/{app_name}/{api_endpoint}/{encoded_stanza}/acl"
-    data_acl = {"owner": "Nobody", "sharing": "app"}
+    # Use all parameters of the object dynamically, the name identifies the new object
+    data = {"name": stanza, **params}
 
-    with log_lock:
-        if args.debug:
-            log_message(logfile, f"--------------------------------------", level="debug")
-            log_message(logfile, f"Processing object: {object_name}", level="debug")
-            log_message(logfile, f"Processing stanza: {stanza}", level="debug")
-            log_message(logfile, f"API URL: {api_call}", level="debug")
-            log_message(logfile, f"Data: {data}", level="debug")
+    if args.debug:
+        log_message(logfile, f"--------------------------------------", level="debug")
+        log_message(logfile, f"Processing object: {object_name}", level="debug")
+        log_message(logfile, f"Processing stanza: {stanza}", level="debug")
+        log_message(logfile, f"API URL: {api_call}", level="debug")
+        log_message(logfile, f"Data: {data}", level="debug")
+        log_message(logfile, f"ACL: {acl if acl else 'inherited'}", level="debug")
 
-    if args.dummy:
-        dummy_api_call(api_call, app_name, object_name, headers, data)
-    else:
-        make_api_call(api_call, app_name, object_name, headers, data)
-        time.sleep(2)
-        make_api_call(api_call_acl, app_name, object_name, headers, data_acl)
-
-def build_enable_url(api_url, token, args, app_name, stanza_name, enabled):
-    encoded_stanza = urllib.parse.quote(stanza_name)
-    encoded_stanza = encoded_stanza.replace("/", "%252F")
-    api_call = f"{api_url}/servicesNS/nobody/{app_name}/configs/conf-savedsearches/{encoded_stanza}"
+    call = {"api_url": api_call, "app_name": app_name, "stanza_name": stanza, "headers": headers, "data": data}
+    if acl:
+        api_call_acl = f"{api_call}/{encode_object_name(stanza)}/acl"
+        call["then"] = {"api_url": api_call_acl, "app_name": app_name, "stanza_name": stanza, "headers": headers, "data": acl, "retry_not_found": True}
+    return call
+
+def prepare_enable_call(api_url, token, args, app_name, stanza_name, enabled):
+    """Build the call that enables or disables a saved search."""
+    api_call = f"{object_url('savedsearches', api_url, app_name)}/{encode_object_name(stanza_name)}"
     headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
     data = {"disabled": "0" if enabled else "1"}
 
-    with log_lock:
-        if args.debug:
-            log_message(logfile, f"--------------------------------------", level="debug")
-            log_message(logfile, f"Processing saved search: {stanza_name}", level="debug")
-            log_message(logfile, f"API URL: {api_call}", level="debug")
-            log_message(logfile, f"Data: {data}", level="debug")
-            
+    if args.debug:
+        log_message(logfile, f"--------------------------------------", level="debug")
+        log_message(logfile, f"Processing saved search: {stanza_name}", level="debug")
+        log_message(logfile, f"API URL: {api_call}", level="debug")
+        log_message(logfile, f"Data: {data}", level="debug")
+
+    return {"api_url": api_call, "app_name": app_name, "stanza_name": stanza_name, "headers": headers, "data": data}
+
+def retry_statuses(call, attempt):
+    """Return the status codes that should not be counted yet for this attempt of the call, as the call will be retried."""
+    statuses = set()
+    if call.get("retry_not_found") and attempt < NOT_FOUND_RETRIES:
+        statuses.add(404)
+    if attempt < max_retries:
+        statuses |= RETRYABLE_STATUS_CODES
+    return statuses
+
+def should_retry(call, status_code, attempt):
+    return status_code in retry_statuses(call, attempt)
+
+def retry_delay(attempt, status_code=None):
+    """Seconds to wait before the next attempt of a call."""
+    if status_code == 404:
+        return NOT_FOUND_DELAY * 2 ** attempt
+    # Exponential backoff with jitter, so calls that failed together are not retried together
+    delay = min(retry_max_delay, retry_base_delay * 2 ** attempt)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def send_call(call, args, attempt=0, breaker=None):
+    """Send a prepared call once and return the status code. breaker: the circuit breaker that admitted the call (admit_call)."""
     if args.dummy:
-        dummy_api_call(api_call, app_name, stanza_name, headers, data)
+        return dummy_api_call(call["api_url"], call["app_name"], call["stanza_name"], call["headers"], call["data"])
+    try:
+        data = call_data(call)
+    except OSError as e:
+        if breaker is not None:
+            breaker.release_probe()
+        record_failure(call["api_url"], call["app_name"], call["stanza_name"], e, network=False)
+        return None
+    statuses = retry_statuses(call, attempt)
+    status_code = make_api_call(call["api_url"], call["app_name"], call["stanza_name"], call["headers"], data, statuses, call.get("maybe_applied", False), breaker)
+    mark_maybe_applied(call, status_code)
+    journal_call(call, status_code, statuses, data)
+    return status_code
+
+def mark_maybe_applied(call, status_code):
+    """Remember that an attempt of the call may have been applied, before it is retried."""
+    if status_code in MAYBE_APPLIED_STATUS_CODES:
+        call["maybe_applied"] = True
+
+def journal_call(call, status_code, retry_statuses=(), data=None):
+    """Record the final result of a call in the journal of the run."""
+    journal = get_journal()
+    if journal is None or status_code is None or status_code in retry_statuses:
+        return
+    try:
+        journal.record(call, status_code, data)
+    except Exception as e:
+        log_message(logfile, f"Error writing the journal for {call['api_url']}: {e}", level="error")
+
+def run_calls(calls, args, max_api_calls):
+    """Run all prepared calls with the thread pool, or with the asyncio engine when selected."""
+    journal = get_journal()
+    if journal is not None and args.resume and not args.dummy:
+        # Skip the calls that completed in an earlier run
+        calls = journal.skip_completed(calls)
+
+    if args.async_engine:
+        from async_engine import run_async_calls
+        run_async_calls(calls, args, read_config_value("max_in_flight", 200))
     else:
-        make_api_call(api_call, app_name, stanza_name, headers, data)
+        from call_pipeline import CallPipeline
+        # Calls that are queued or running per target, the calls are prepared only as fast as they are sent
+        max_items = read_config_value("max_pending_calls", 0) or max_api_calls * 10
+        # Every target gets its own worker threads and window of calls, so a slow or throttled target does not hold up the others:
+        # its calls are parked, and the producer only waits when every target has a full window and max_items parked calls
+        executors = {}
+        pipelines = {}
+        room = threading.Condition()
+        try:
+            for call in calls:
+                target = target_of(call["api_url"])
+                pipeline = pipelines.get(target)
+                if pipeline is None:
+                    executors[target] = ThreadPoolExecutor(max_workers=max_api_calls)
+                    pipeline = pipelines[target] = CallPipeline(executors[target], args, max_items, room)
+                pipeline.submit(call)
+                with room:
+                    while all(pipeline.is_full() for pipeline in pipelines.values()):
+                        room.wait(0.5)
+            # Wait for all calls, including the follow-up calls, to complete
+            for pipeline in pipelines.values():
+                pipeline.wait()
+        except KeyboardInterrupt:
+            # Do not send the queued calls, the journal allows to resume the run
+            for executor in executors.values():
+                executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        finally:
+            for executor in executors.values():
+                executor.shutdown(wait=True)
+
+    if journal is not None and args.resume and not args.dummy:
+        print(f"Skipped {journal.skipped} API calls that completed in an earlier run.")
+        log_message(logfile, f"Skipped {journal.skipped} API calls that completed in an earlier run.", level="info")
+
+def fetch_saved_search_state(api_url, token, app_name, page_size=0):
+    """
+    Return the current 'disabled' state of the saved searches owned by an app on the stack,
+    as a dictionary of stanza name -> True/False. Returns None when the state cannot be fetched.
+    page_size 0 lists all saved searches with a single GET.
+    """
+    listing_url = f"{api_url}/servicesNS/nobody/{urllib.parse.quote(app_name)}/configs/conf-savedsearches"
+    headers = {"Authorization": f"Bearer {token}"}
+    state = {}
+    offset = 0
+
+    try:
+        while True:
+            params = {"output_mode": "json", "count": page_size, "offset": offset, "f": "disabled", "search": f"eai:acl.app={app_name}"}
+            get_rate_limiter(api_url).acquire()
+            response = get_session(api_url).get(listing_url, headers=headers, params=params, verify=False)
+            if response.status_code != 200:
+                log_message(logfile, f"Could not fetch saved search state for {app_name}. Status Code: {response.status_code}", level="error")
+                return None
+
+            listing = response.json()
+            entries = listing.get("entry", [])
+            for entry in entries:
+                # The listing also contains globally shared searches of other apps
+                if entry.get("acl", {}).get("app", app_name) != app_name:
+                    continue
+                disabled = entry.get("content", {}).get("disabled", False)
+                if isinstance(disabled, str):
+                    disabled = disabled.lower() in ("1", "true")
+                state[entry["name"]] = bool(disabled)
+
+            offset += len(entries)
+            total = listing.get("paging", {}).get("total", offset)
+            if page_size <= 0 or not entries or offset >= total:
+                break
+
+        log_message(logfile, f"Fetched the state of {len(state)} saved searches for {app_name}", level="info")
+        return state
+
+    except requests.exceptions.RequestException as e:
+        log_message(logfile, f"Could not fetch saved search state for {app_name}. Network error: {e}", level="error")
+    except Exception as e:
+        log_message(logfile, f"Could not fetch saved search state for {app_name}. Unexpected error: {e}", level="error")
+    return None
 
 def syntax_check(api_url):
     try:
@@ -0,0 +1,102 @@
+### DISCLAIMER
+# USE THE SCRIPT AT YOUR OWN RISK
+# ALWAYS VERIFY RESULTS
+
+import os, sys
+import errno
+import shutil
+
+# import custom lib
+sys.path.append(os.path.join(os.path.dirname(__file__), "lib"))
+
+from script_logger import log_message
+
+__name__ = "app_staging.py"
+__author__ = "Michel de Jong"
+logfile = "disabling_savedsearches"
+
+# Linux ioctl to clone a file on copy-on-write filesystems (btrfs, xfs, ...)
+FICLONE = 0x40049409
+
+# Errors that mean a link or clone is not possible here, so the next method has to be used
+UNSUPPORTED_ERRORS = {errno.EXDEV, errno.EPERM, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL, errno.EMLINK, errno.ENOSYS}
+
+# Files that are rewritten after staging and therefore always get a real copy
+REWRITTEN_FILES = {os.path.join("default", "savedsearches.conf"), os.path.join("local", "savedsearches.conf")}
+
+class AppStager:
+    """
+    Stage an apps directory by reflinking (or else hardlinking) every file that is not rewritten.
+    Staged files share their data with the original, so they must not be modified in place.
+    """
+    def __init__(self):
+        self.reflink_supported = hasattr(os, "O_RDONLY") and sys.platform.startswith("linux")
+        self.hardlink_supported = True
+        self.counts = {"reflinked": 0, "hardlinked": 0, "copied": 0}
+
+    def reflink(self, source, target):
+        import fcntl
+        with open(source, 'rb') as source_file, open(target, 'wb') as target_file:
+            fcntl.ioctl(target_file.fileno(), FICLONE, source_file.fileno())
+        shutil.copystat(source, target)
+
+    def stage_file(self, source, target, rewritten=False):
+        if not rewritten:
+            if self.reflink_supported:
+                try:
+                    self.reflink(source, target)
+                    self.counts["reflinked"] += 1
+                    return
+                except OSError as e:
+                    if os.path.exists(target):
+                        os.remove(target)
+                    if e.errno not in UNSUPPORTED_ERRORS:
+                        raise
+                    self.reflink_supported = False
+            if self.hardlink_supported:
+                try:
+                    os.link(source, target)
+                    self.counts["hardlinked"] += 1
+                    return
+                except OSError as e:
+                    if e.errno not in UNSUPPORTED_ERRORS:
+                        raise
+                    self.hardlink_supported = False
+        shutil.copy2(source, target)
+        self.counts["copied"] += 1
+
+    def stage_app(self, source_app, target_app):
+        """Stage one app directory. Symlinked directories are staged with their contents, as copytree does."""
+        staged_dirs = []
+        visited = {os.path.realpath(source_app)}
+        for root, dirs, files in os.walk(source_app, followlinks=True):
+            # A symlink to a directory that is already staged (e.g. to a parent) would be walked forever
+            for dirname in [dirname for dirname in dirs if os.path.islink(os.path.join(root, dirname))]:
+                real_path = os.path.realpath(os.path.join(root, dirname))
+                if real_path in visited:
+                    log_message(logfile, f"Skipped the symlinked directory {os.path.join(root, dirname)}, it links to a directory that is already staged", level="info")
+                    dirs.remove(dirname)
+                else:
+                    visited.add(real_path)
+            relative_root = os.path.relpath(root, source_app)
+            target_root = os.path.normpath(os.path.join(target_app, relative_root))
+            os.makedirs(target_root, exist_ok=True)
+            staged_dirs.append((root, target_root))
+            for filename in files:
+                relative_path = os.path.normpath(os.path.join(relative_root, filename))
+                self.stage_file(os.path.join(root, filename), os.path.join(target_root, filename), relative_path in REWRITTEN_FILES)
+        # Directory timestamps and permissions, as copytree does, subdirectories first
+        for root, target_root in reversed(staged_dirs):
+            shutil.copystat(root, target_root)
+
+    def stage_apps(self, apps_dir, target_dir):
+        """Stage all apps of apps_dir into target_dir."""
+        os.makedirs(target_dir, exist_ok=True)
+        for app_name in os.listdir(apps_dir):
+            source = os.path.join(apps_dir, app_name)
+            if os.path.isdir(source):
+                self.stage_app(source, os.path.join(target_dir, app_name))
+            else:
+                self.stage_file(source, os.path.join(target_dir, app_name))
+        log_message(logfile, f"Staged {apps_dir} to {target_dir}: {self.counts}", level="info")
+        return self.counts
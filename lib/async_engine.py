@@ -0,0 +1,193 @@
+### DISCLAIMER
+# USE THE SCRIPT AT YOUR OWN RISK
+# ALWAYS VERIFY RESULTS
+
+import os, sys
+import asyncio
+import threading
+import datetime
+
+# import custom lib
+sys.path.append(os.path.join(os.path.dirname(__file__), "lib"))
+
+from script_logger import log_message
+import api_caller
+from api_caller import record_response, record_failure, dummy_api_call, journal_call, retry_statuses, should_retry, retry_delay, accepted_status, mark_maybe_applied, admit_call, SUCCESS_STATUS_CODES, NO_RESPONSE
+from rate_limiter import get_rate_limiter
+from run_metrics import record_call
+from utils import target_of, call_data
+
+__name__ = "async_engine.py"
+__author__ = "Michel de Jong"
+logfile = "rest_api_runner"
+
+async def send_call(session, call, args, attempt=0, breaker=None):
+    """
+    Send one prepared call and return the status code, or None when the call failed without a response.
+    breaker: the circuit breaker that admitted the call (admit_call), None when the endpoint is down.
+    """
+    if args.dummy:
+        # Give the other calls a turn, as a real request would
+        await asyncio.sleep(0)
+        return dummy_api_call(call["api_url"], call["app_name"], call["stanza_name"], call["headers"], call["data"])
+
+    import aiohttp
+
+    api_url = call["api_url"]
+    statuses = retry_statuses(call, attempt)
+    try:
+        data = call_data(call)
+    except OSError as e:
+        if breaker is not None:
+            breaker.release_probe()
+        record_failure(api_url, call["app_name"], call["stanza_name"], e, network=False)
+        return None
+
+    if breaker is None:
+        record_failure(api_url, call["app_name"], call["stanza_name"], "the circuit breaker is open, the endpoint keeps failing", network=True)
+        return None
+
+    try:
+        limiter = get_rate_limiter(api_url)
+        wait = limiter.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        st = datetime.datetime.now()
+        async with session.post(api_url, headers=call["headers"], data=data) as response:
+            response_text = await response.text()
+        et = datetime.datetime.now()
+        timetaken = (et - st).total_seconds()
+        record_call(api_url, response.status, timetaken)
+        breaker.on_result(response.status)
+        if limiter.on_response(response.status, response.headers.get("Retry-After")):
+            log_message(logfile, f"Throttled by {api_url} (Status Code: {response.status}), lowering the call rate", level="info")
+
+        if response.status in statuses:
+            log_message(logfile, f"API call for {api_url}, '{call['stanza_name']}' in {call['app_name']} returned {response.status}, retrying", level="info")
+            return response.status
+
+        status_code = accepted_status(api_url, call["app_name"], call["stanza_name"], response.status, call.get("maybe_applied", False))
+        record_response(api_url, call["app_name"], call["stanza_name"], status_code, response_text, timetaken)
+        journal_call(call, status_code, data=data)
+        return status_code
+
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        record_call(api_url, None, None)
+        breaker.on_result(NO_RESPONSE)
+        if NO_RESPONSE in statuses:
+            log_message(logfile, f"API call for {api_url}, '{call['stanza_name']}' in {call['app_name']} failed with a network error, retrying: {e}", level="info")
+            return NO_RESPONSE
+        record_failure(api_url, call["app_name"], call["stanza_name"], e, network=True)
+    except Exception as e:
+        record_call(api_url, None, None)
+        breaker.on_result(None)
+        record_failure(api_url, call["app_name"], call["stanza_name"], e, network=False)
+    return None
+
+async def run_call(session, call, args, in_flight, holds_slot=True):
+    """Run a call and its follow-up call, holding an in-flight slot only while a request is open."""
+    attempt = 0
+    while True:
+        if not holds_slot:
+            await in_flight.acquire()
+        wait = 0
+        try:
+            breaker = None
+            if not args.dummy:
+                breaker, wait = admit_call(call["api_url"])
+            if breaker is None or wait <= 0:
+                status_code = await send_call(session, call, args, attempt, breaker)
+                mark_maybe_applied(call, status_code)
+        finally:
+            in_flight.release()
+            holds_slot = False
+
+        if wait > 0:
+            # The endpoint is paused, wait without holding an in-flight slot of the target
+            await asyncio.sleep(wait)
+            continue
+        if not should_retry(call, status_code, attempt):
+            break
+        await asyncio.sleep(retry_delay(attempt, status_code))
+        attempt += 1
+
+    # The follow-up call depends on the object created by this call
+    follow_up = call.get("then")
+    if follow_up and status_code in SUCCESS_STATUS_CODES:
+        await run_call(session, follow_up, args, in_flight, holds_slot=False)
+
+# End of the calls of the producer thread
+PRODUCER_DONE = object()
+
+class ProducerError:
+    """An exception of the call generator, raised again on the event loop."""
+    def __init__(self, error):
+        self.error = error
+
+def produce_calls(calls, loop, queue, room, stop):
+    """Put the calls of the generator on the queue of the event loop, with at most as many waiting calls as room allows."""
+    def put(item):
+        room.acquire()
+        if stop.is_set():
+            return False
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+        except RuntimeError:
+            # The event loop is closed
+            return False
+        return True
+
+    try:
+        for call in calls:
+            if not put(call):
+                return
+    except Exception as e:
+        put(ProducerError(e))
+        return
+    put(PRODUCER_DONE)
+
+async def run_calls_async(calls, args, max_in_flight):
+    # Every target has its own in-flight limit
+    in_flight = {}
+    tasks = set()
+
+    session = None
+    if not args.dummy:
+        import aiohttp
+        connector = aiohttp.TCPConnector(limit=0, limit_per_host=max_in_flight, ssl=False)
+        session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=api_caller.request_timeout))
+
+    # The calls are produced while parsing the apps (and with -diff, comparing them with the target),
+    # so the generator runs on a producer thread, not on the event loop
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    room = threading.Semaphore(max_in_flight)
+    stop = threading.Event()
+    producer = threading.Thread(target=produce_calls, args=(calls, loop, queue, room, stop), name="call_producer", daemon=True)
+    producer.start()
+    try:
+        while True:
+            call = await queue.get()
+            room.release()
+            if call is PRODUCER_DONE:
+                break
+            if isinstance(call, ProducerError):
+                raise call.error
+            target_slots = in_flight.setdefault(target_of(call["api_url"]), asyncio.Semaphore(max_in_flight))
+            # Wait for a free slot of the target before scheduling the next call
+            await target_slots.acquire()
+            task = asyncio.ensure_future(run_call(session, call, args, target_slots))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks)
+    finally:
+        stop.set()
+        room.release()
+        if session is not None:
+            await session.close()
+
+def run_async_calls(calls, args, max_in_flight=200):
+    """Run all prepared calls on a single thread with up to max_in_flight open requests per target."""
+    log_message(logfile, f"Running API calls with the asyncio engine, max {max_in_flight} calls in flight per target", level="info")
+    asyncio.run(run_calls_async(calls, args, max(1, int(max_in_flight))))
@@ -0,0 +1,105 @@
+### DISCLAIMER
+# USE THE SCRIPT AT YOUR OWN RISK
+# ALWAYS VERIFY RESULTS
+
+import os, sys
+import json
+import sqlite3
+import hashlib
+import datetime
+import threading
+import urllib.parse
+
+# import custom lib
+sys.path.append(os.path.join(os.path.dirname(__file__), "lib"))
+
+from script_logger import log_message
+from utils import call_data
+
+__name__ = "call_journal.py"
+__author__ = "Michel de Jong"
+logfile = "rest_api_runner"
+
+SUCCESS_STATUS_CODES = (200, 201)
+
+def payload_hash(data):
+    """Stable hash of the payload of a call."""
+    return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+class CallJournal:
+    """
+    Append-only journal of completed API calls in a local SQLite database.
+    Every call is committed (and synced to disk) as soon as it completes, so an interrupted run can be resumed.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=FULL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS calls ("
+            "target TEXT, app TEXT, endpoint TEXT, stanza TEXT, payload_hash TEXT, status INTEGER, completed_at TEXT)"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS calls_endpoint ON calls (endpoint, stanza, payload_hash)")
+        self.skipped = 0
+
+    def record(self, call, status_code, data=None):
+        api_url = call["api_url"]
+        parsed = urllib.parse.urlparse(api_url)
+        row = (
+            f"{parsed.scheme}://{parsed.netloc}",
+            call["app_name"],
+            api_url,
+            call["stanza_name"],
+            payload_hash(data if data is not None else call_data(call)),
+            status_code,
+            datetime.datetime.now().isoformat(),
+        )
+        with self.lock:
+            self.connection.execute("INSERT INTO calls VALUES (?, ?, ?, ?, ?, ?, ?)", row)
+
+    def is_completed(self, call):
+        """A call is completed when the same endpoint got the same payload for the same stanza with a 2xx status before."""
+        with self.lock:
+            cursor = self.connection.execute(
+                "SELECT 1 FROM calls WHERE endpoint = ? AND stanza = ? AND payload_hash = ? AND status IN (?, ?) LIMIT 1",
+                (call["api_url"], call["stanza_name"], payload_hash(call_data(call))) + SUCCESS_STATUS_CODES,
+            )
+            return cursor.fetchone() is not None
+
+    def skip_completed(self, calls):
+        """Yield the calls that still have to be made. A completed call can still have an open follow-up call."""
+        for call in calls:
+            while call is not None and self.is_completed(call):
+                self.skipped += 1
+                call = call.get("then")
+            if call is not None:
+                yield call
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+# Journal of the current run, None when journaling is off
+journal = None
+
+def open_journal(path):
+    global journal
+    try:
+        journal = CallJournal(path)
+        log_message(logfile, f"Recording completed API calls in {path}", level="info")
+    except sqlite3.Error as e:
+        journal = None
+        print(f"Could not open the journal {path}: {e}. Continuing without journal.")
+        log_message(logfile, f"Could not open the journal {path}: {e}", level="error")
+    return journal
+
+def get_journal():
+    return journal
+
+def close_journal():
+    global journal
+    if journal is not None:
+        journal.close()
+        journal = None
@@ -0,0 +1,151 @@
+### DISCLAIMER
+# USE THE SCRIPT AT YOUR OWN RISK
+# ALWAYS VERIFY RESULTS
+
+import os, sys
+import threading
+from collections import deque
+
+# import custom lib
+sys.path.append(os.path.join(os.path.dirname(__file__), "lib"))
+
+from script_logger import log_message
+from api_caller import send_call, admit_call, should_retry, retry_delay, SUCCESS_STATUS_CODES
+
+__name__ = "call_pipeline.py"
+__author__ = "Michel de Jong"
+logfile = "rest_api_runner"
+
+class CallPipeline:
+    """
+    Run prepared calls on a thread pool.
+    A follow-up call (e.g. the ACL update of a created object) is queued only when its parent call succeeded,
+    and a retry is scheduled with a timer, so no worker thread is kept waiting.
+    With max_items, at most max_items calls (with their retries and follow-up calls) are queued or running.
+    Further calls are parked and take over the slot of the next call that is done, so submit never blocks and
+    a slow target does not hold up the producer of the other targets. room is notified when a slot is taken over.
+    A call to an endpoint paused by its circuit breaker gives up its slot and waits, with the other calls of that
+    endpoint, for one timer; the calls are parked again in front when the pause is over.
+    """
+    def __init__(self, executor, args, max_items=0, room=None):
+        self.executor = executor
+        self.args = args
+        self.pending = 0
+        self.condition = threading.Condition()
+        self.max_items = max_items
+        self.active = 0
+        self.parked = deque()
+        self.paused = {}
+        self.room = room
+
+    def submit(self, call):
+        """Queue a new call, or park it when the pipeline is full."""
+        with self.condition:
+            if self.max_items > 0 and self.active >= self.max_items:
+                self.parked.append((call, 0))
+                return
+            self.active += 1
+        self._submit(call, 0)
+
+    def is_full(self):
+        """True when the pipeline has max_items calls running and max_items calls parked or paused."""
+        if self.max_items == 0:
+            return False
+        with self.condition:
+            return len(self.parked) >= self.max_items or sum(len(calls) for calls in self.paused.values()) >= self.max_items
+
+    def _submit(self, call, attempt):
+        with self.condition:
+            self.pending += 1
+        self.executor.submit(self._run, call, attempt)
+
+    def _schedule_retry(self, call, attempt, delay):
+        # The timer counts as pending work until the call is back in the pool
+        with self.condition:
+            self.pending += 1
+        timer = threading.Timer(delay, self._resubmit, (call, attempt))
+        timer.daemon = True
+        timer.start()
+
+    def _resubmit(self, call, attempt):
+        try:
+            self._submit(call, attempt)
+        finally:
+            self._done()
+
+    def _pause(self, breaker, call, attempt, wait):
+        # The first paused call of an endpoint starts the timer, the timer counts as pending work
+        with self.condition:
+            calls = self.paused.setdefault(breaker, [])
+            calls.append((call, attempt))
+            if len(calls) > 1:
+                return
+            self.pending += 1
+        timer = threading.Timer(wait, self._resume, (breaker,))
+        timer.daemon = True
+        timer.start()
+
+    def _resume(self, breaker):
+        try:
+            with self.condition:
+                calls = self.paused.pop(breaker, [])
+                self.parked.extendleft(reversed(calls))
+            self._fill_slots()
+        finally:
+            self._done()
+
+    def _run(self, call, attempt):
+        item_done = True
+        try:
+            breaker = None
+            if not self.args.dummy:
+                # breaker is None when the endpoint is down, send_call then fails the call
+                breaker, wait = admit_call(call["api_url"])
+                if breaker is not None and wait > 0:
+                    # The endpoint is paused, the call gives up its slot until the pause is over
+                    self._pause(breaker, call, attempt, wait)
+                    return
+            status_code = send_call(call, self.args, attempt, breaker)
+            if should_retry(call, status_code, attempt):
+                self._schedule_retry(call, attempt + 1, retry_delay(attempt, status_code))
+                item_done = False
+            elif call.get("then") and status_code in SUCCESS_STATUS_CODES:
+                # The follow-up call takes over the slot of its parent call
+                self._submit(call["then"], 0)
+                item_done = False
+        except Exception as e:
+            log_message(logfile, f"Error running API call for {call.get('api_url')}: {e}", level="error")
+        finally:
+            if item_done:
+                self._release_slot()
+            self._done()
+
+    def _release_slot(self):
+        with self.condition:
+            self.active -= 1
+        self._fill_slots()
+
+    def _fill_slots(self):
+        # Parked calls take over the free slots
+        with self.condition:
+            calls = []
+            while self.parked and (self.max_items == 0 or self.active < self.max_items):
+                calls.append(self.parked.popleft())
+                self.active += 1
+        for call, attempt in calls:
+            self._submit(call, attempt)
+        if calls and self.room is not None:
+            with self.room:
+                self.room.notify_all()
+
+    def _done(self):
+        with self.condition:
+            self.pending -= 1
+            if self.pending == 0:
+                self.condition.notify_all()
+
+    def wait(self):
+        """Block until all calls, including the parked and follow-up calls, are done."""
+        with self.condition:
+            while self.pending > 0 or self.parked:
+                self.condition.wait()
@@ -0,0 +1,122 @@
+### DISCLAIMER
+# USE THE SCRIPT AT YOUR OWN RISK
+# ALWAYS VERIFY RESULTS
+
+import os, sys
+import time
+import threading
+
+# import custom lib
+sys.path.append(os.path.join(os.path.dirname(__file__), "lib"))
+
+from script_logger import log_message
+from utils import target_of
+from run_metrics import endpoint_label
+
+__name__ = "circuit_breaker.py"
+__author__ = "Michel de Jong"
+logfile = "rest_api_runner"
+
+# Responses that count as a failure of the endpoint (0: no response received)
+FAILURE_STATUS_CODES = {0, 500, 502, 503, 504}
+
+# Seconds a call waits before checking again while another call probes a half-open endpoint
+PROBE_WAIT = 0.5
+
+class CircuitBreaker:
+    """
+    Circuit breaker for one endpoint of a target.
+    - closed: calls are sent
+    - open: after failure_threshold failures in a row, calls wait until the cooldown is over
+    - half-open: after the cooldown, one call probes the endpoint. A success closes the circuit,
+      a failure opens it again with a doubled cooldown
+    After max_trips openings without a success the endpoint is considered down, and its calls fail immediately.
+    """
+    def __init__(self, name, failure_threshold=5, cooldown=10.0, max_cooldown=120.0, max_trips=5):
+        self.name = name
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.base_cooldown = float(cooldown)
+        self.cooldown = float(cooldown)
+        self.max_cooldown = float(max_cooldown)
+        self.max_trips = max(1, int(max_trips))
+        self.state = "closed"
+        self.failures = 0
+        self.trips = 0
+        self.open_until = 0.0
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def before_call(self):
+        """Return (allowed, wait): the call fails when not allowed, and waits 'wait' seconds before asking again."""
+        with self.lock:
+            if self.state == "down":
+                return False, 0.0
+            now = time.monotonic()
+            if self.state == "open":
+                if now < self.open_until:
+                    return True, self.open_until - now
+                self.state = "half-open"
+                self.probing = False
+            if self.state == "half-open":
+                if self.probing:
+                    return True, PROBE_WAIT
+                self.probing = True
+            return True, 0.0
+
+    def release_probe(self):
+        """Let another call probe the half-open endpoint, when the admitted call was not sent (e.g. its payload could not be read)."""
+        with self.lock:
+            self.probing = False
+
+    def on_result(self, status_code):
+        """Update the circuit with the status code of a call (0 when no response was received)."""
+        with self.lock:
+            if status_code not in FAILURE_STATUS_CODES:
+                if self.state != "closed":
+                    log_message(logfile, f"Circuit breaker for {self.name} closed, the endpoint responds again", level="info")
+                self.state = "closed"
+                self.failures = 0
+                self.trips = 0
+                self.cooldown = self.base_cooldown
+                self.probing = False
+                return
+
+            self.failures += 1
+            if self.state == "half-open" or (self.state == "closed" and self.failures >= self.failure_threshold):
+                self.trips += 1
+                self.probing = False
+                if self.trips > self.max_trips:
+                    self.state = "down"
+                    log_message(logfile, f"Circuit breaker for {self.name}: still failing after {self.max_trips} pauses, failing its remaining calls", level="error")
+                    return
+                if self.state == "half-open":
+                    self.cooldown = min(self.max_cooldown, self.cooldown * 2)
+                self.state = "open"
+                self.open_until = time.monotonic() + self.cooldown
+                log_message(logfile, f"Circuit breaker for {self.name} opened after {self.failures} failures, pausing its calls for {self.cooldown:.1f}s", level="error")
+
+# One breaker per target and endpoint, shared by all worker threads
+breakers = {}
+breaker_settings = {}
+breaker_lock = threading.Lock()
+
+def configure_circuit_breakers(failure_threshold=5, cooldown=10.0, max_cooldown=120.0, max_trips=5):
+    with breaker_lock:
+        breaker_settings.update(failure_threshold=failure_threshold, cooldown=cooldown, max_cooldown=max_cooldown, max_trips=max_trips)
+        breakers.clear()
+
+def breaker_key(api_url):
+    """Target and endpoint of an API url (e.g. https://host:8089 configs/conf-macros), shared by all apps and objects."""
+    return f"{target_of(api_url)} {endpoint_label(api_url)}"
+
+def get_circuit_breaker(api_url):
+    """Return the circuit breaker of the endpoint of the given API url."""
+    key = breaker_key(api_url)
+    breaker = breakers.get(key)
+    if breaker is None:
+        with breaker_lock:
+            breaker = breakers.get(key)
+            if breaker is None:
+                breaker = CircuitBreaker(key, **breaker_settings)
+                breakers[key] = breaker
+    return breaker
@@ -0,0 +1,58 @@
+### DISCLAIMER
+# USE THE SCRIPT AT YOUR OWN RISK
+# ALWAYS VERIFY RESULTS
+
+import os, sys
+
+# import custom lib
+sys.path.append(os.path.join(os.path.dirname(__file__), "lib"))
+
+from stanza_model import Stanza
+
+__name__ = "conf_merge.py"
+__author__ = "Michel de Jong"
+
+# Settings of the [default] stanza (and settings before the first stanza) apply to every stanza of the file
+DEFAULT_STANZA = "default"
+
+# Configuration layers of an app, lowest precedence first
+APP_LAYERS = ("default", "local")
+
+def merge_layers(layers):
+    """
+    Return the effective stanzas of a .conf file from its layers (lowest precedence first, e.g. default then local),
+    as a dictionary of stanza name -> Stanza. Like Splunk:
+    - a setting of a higher layer overrides the same setting of a lower layer
+    - the merged [default] stanza provides the settings a stanza does not set itself, and is not a stanza itself
+    """
+    merged = {}
+    copied = set()
+    for layer in layers:
+        for name, settings in layer.items():
+            current = merged.get(name)
+            if current is None:
+                merged[name] = settings
+                continue
+            # Copy before updating, the parsed layers are shared with the parse cache
+            if name not in copied:
+                current = dict(current)
+                copied.add(name)
+            current.update(settings)
+            merged[name] = current
+
+    defaults = merged.pop(DEFAULT_STANZA, None)
+    effective = {}
+    for name, settings in merged.items():
+        if defaults:
+            settings = {**defaults, **settings}
+        effective[name] = settings if isinstance(settings, Stanza) else Stanza(settings)
+    return effective
+
+def app_layer_paths(app_path, relative_path):
+    """Return the existing paths of a file in the layers of an app, lowest precedence first."""
+    paths = []
+    for layer in APP_LAYERS:
+        path = os.path.join(app_path, layer, relative_path)
+        if os.path.exists(path):
+            paths.append(path)
+    return paths
@@ -0,0 +1,97 @@
+### DISCLAIMER
+# USE THE SCRIPT AT YOUR OWN RISK
+# ALWAYS VERIFY RESULTS
+
+import os, re, sys
+from collections import namedtuple
+
+__name__ = "conf_parser.py"
+__author__ = "Michel de Jong"
+
+# Precompiled patterns, shared by all parsers
+STANZA_PATTERN = re.compile(r'^\[(.*)\]$')
+
+# One logical line of a .conf file
+# - key/value: None for comments, blank lines and lines without '='
+# - raw: the original text, including continuation lines, without the final newline
+ConfLine = namedtuple("ConfLine", ["key", "value", "raw"])
+
+def iter_logical_lines(path):
+    """
+    Yield the logical lines of a .conf file, one physical line at a time.
+    Lines ending with a backslash continue on the next line. The value keeps the line breaks.
+    """
+    with open(path, 'r', encoding='utf-8') as file:
+        raw_parts = []
+        value_parts = []
+        for line in file:
+            line = line.rstrip('\r\n')
+            if line.endswith('\\'):
+                raw_parts.append(line)
+                value_parts.append(line[:-1])
+                continue
+            if raw_parts:
+                raw_parts.append(line)
+                value_parts.append(line)
+                yield '\n'.join(value_parts), '\n'.join(raw_parts), True
+                raw_parts = []
+                value_parts = []
+            else:
+                yield line, line, False
+        if raw_parts:
+            # File ends with a backslash
+            yield '\n'.join(value_parts), '\n'.join(raw_parts), True
+
+def iter_conf_blocks(path):
+    """
+    Yield (stanza_name, lines) for every stanza of a .conf file, one stanza at a time.
+    Lines before the first stanza are yielded with stanza_name None.
+    """
+    stanza_name = None
+    lines = []
+    for text, raw, continued in iter_logical_lines(path):
+        stripped = text.strip()
+        if not continued:
+            if not stripped or stripped.startswith('#'):
+                lines.append(ConfLine(None, None, raw))
+                continue
+            stanza_match = STANZA_PATTERN.match(stripped) if stripped[0] == '[' else None
+            if stanza_match:
+                if stanza_name is not None or lines:
+                    yield stanza_name, lines
+                stanza_name = stanza_match.group(1)
+                lines = []
+                continue
+
+        key, separator, value = text.partition('=')
+        key = key.strip()
+        if separator and key:
+            lines.append(ConfLine(key, value.strip(), raw))
+        else:
+            lines.append(ConfLine(None, None, raw))
+
+    if stanza_name is not None or lines:
+        yield stanza_name, lines
+
+def iter_stanzas(path, global_stanza=None):
+    """
+    Yield (stanza_name, settings) for every stanza of a .conf file, one stanza at a time.
+    Settings before the first stanza are skipped, or yielded as global_stanza (e.g. "default", as Splunk does).
+    """
+    for stanza_name, lines in iter_conf_blocks(path):
+        if stanza_name is None:
+            if global_stanza is None:
+                continue
+            stanza_name = global_stanza
+        settings = {line.key: line.value for line in lines if line.key is not None}
+        if stanza_name == global_stanza and not settings:
+            continue
+        yield stanza_name, settings
+
+def parse_conf(path):
+    """Return all stanzas of a .conf file as a dictionary. Repeated stanzas are merged."""
+    stanzas = {}
+    if os.path.exists(path):
+        for stanza_name, settings in iter_stanzas(path):
+            stanzas.setdefault(stanza_name, {}).update(settings)
+    return stanzas
@@ -0,0 +1,91 @@
+### DISCLAIMER
+# USE THE SCRIPT AT YOUR OWN RISK
+# ALWAYS VERIFY RESULTS
+
+import os, sys
+import json
+import hashlib
+
+# import custom lib
+sys.path.append(os.path.join(os.path.dirname(__file__), "lib"))
+
+from script_logger import log_message
+
+__name__ = "disable_manifest.py"
+__author__ = "Michel de Jong"
+logfile = "disabling_savedsearches"
+
+# Bump when the rewrite of savedsearches.conf changes, so all apps are processed again
+MANIFEST_VERSION = 1
+
+# Output files written by the disable mode, relative to the app directory
+OUTPUT_FILES = (os.path.join("default", "savedsearches.conf"), os.path.join("local", "savedsearches.conf"))
+
+def manifest_path(disabled_ss_dir):
+    # Next to the output directory, so it is never packaged with the apps
+    return f"{disabled_ss_dir}.manifest.json"
+
+def load_manifest(path):
+    """Return the apps of the manifest, or an empty dictionary when there is no usable manifest."""
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            manifest = json.load(file)
+        if manifest.get("version") != MANIFEST_VERSION:
+            return {}
+        return manifest.get("apps", {})
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(path, apps):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        json.dump({"version": MANIFEST_VERSION, "apps": apps}, file)
+    os.replace(temp_path, path)
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def scan_app(app_dir, previous_files=None):
+    """
+    Return (files, app_hash) for a source app.
+    files maps the relative path of every file to [size, mtime_ns, sha256]. The sha256 of the previous
+    run is reused when size and mtime did not change, so unchanged apps are not read again.
+    """
+    previous_files = previous_files or {}
+    files = {}
+    for root, dirs, filenames in os.walk(app_dir):
+        dirs.sort()
+        for filename in sorted(filenames):
+            path = os.path.join(root, filename)
+            relative_path = os.path.relpath(path, app_dir)
+            stat = os.stat(path)
+            previous = previous_files.get(relative_path)
+            if previous and previous[0] == stat.st_size and previous[1] == stat.st_mtime_ns:
+                content_hash = previous[2]
+            else:
+                content_hash = file_hash(path)
+            files[relative_path] = [stat.st_size, stat.st_mtime_ns, content_hash]
+
+    digest = hashlib.sha256()
+    for relative_path in sorted(files):
+        digest.update(f"{relative_path}\0{files[relative_path][2]}\n".encode("utf-8"))
+    return files, digest.hexdigest()
+
+def output_hashes(app_dir):
+    """Return the sha256 of the rewritten files of an output app."""
+    hashes = {}
+    for relative_path in OUTPUT_FILES:
+        path = os.path.join(app_dir, relative_path)
+        if os.path.isfile(path):
+            hashes[relative_path] = file_hash(path)
+    return hashes
+
+def app_is_current(entry, app_hash, output_dir):
+    """An output app can be reused when its source did not change and its output was not modified."""
+    if not entry or entry.get("source_hash") != app_hash or not os.path.isdir(output_dir):
+        return False
+    return output_hashes(output_dir) == entry.get("output", {})
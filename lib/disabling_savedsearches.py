@@ -3,144 +3,260 @@
 # ALWAYS VERIFY RESULTS
 
 import os
-import re
 import sys
 import shutil
 import datetime
+import time
 
 # import custom lib
 sys.path.append(os.path.join(os.path.dirname(__file__), "lib"))
 
-from script_logger import log_message
+from script_logger import log_message, flush_logs
+from utils import read_config_value
+from conf_parser import iter_conf_blocks
+from app_staging import AppStager
+from disable_manifest import manifest_path, load_manifest, save_manifest, scan_app, output_hashes, app_is_current
 
 __name__ = "disabling_savedsearches.py"
 __author__ = "Michel de Jong"
 logfile = "disabling_savedsearches"
 
+def iter_disabled_lines(file_path, args):
+    """Yield the lines of a savedsearches.conf file with 'disabled = 1' added to every stanza."""
+    for stanza_name, lines in iter_conf_blocks(file_path):
+        if stanza_name is not None:
+            log_message(logfile, f"Found stanza: {stanza_name}", level="info")
+            if args.debug:
+                log_message(logfile, f"Lines read for stanza {stanza_name} in {file_path}: {[line.raw for line in lines]}", level="debug")
+            # Ensure 'disabled = 1' is the first parameter in the stanza
+            yield f"[{stanza_name}]"
+            if not any(line.key == 'disabled' for line in lines):
+                yield "disabled = 1"
+        for line in lines:
+            yield line.raw
+
 def process_file(file_path, args):
+    """Add 'disabled = 1' to the stanzas of a savedsearches.conf file. Returns False when the file could not be rewritten."""
+    temp_path = f"{file_path}.tmp"
     try:
         log_message(logfile, f"Processing file: {file_path}", level="info")
         if not os.path.exists(file_path):
             log_message(logfile, f"File {file_path} does not exist.", level="error")
-            return
+            return False
 
-        with open(file_path, 'r', encoding='utf-8') as file:
-            lines = file.readlines()
+        # Stream the stanzas into a temporary file and swap it in when complete
+        with open(temp_path, 'w', encoding='utf-8') as output:
+            written = False
+            blank_lines = 0
+            for line in iter_disabled_lines(file_path, args):
+                # Leading and trailing blank lines are dropped
+                if not line.strip():
+                    if written:
+                        blank_lines += 1
+                    continue
+                output.write('\n' * blank_lines + line + '\n')
+                blank_lines = 0
+                written = True
 
-        if args.debug:
-            log_message(logfile, f"Lines read from {file_path}: {lines}", level="debug")
+        os.replace(temp_path, file_path)
 
-        updated_lines = []
-        current_stanza = None
-        stanza_lines = []
-        in_multiline_value = False
+        log_message(logfile, f"Successfully processed and updated {file_path}", level="info")
+        return True
 
-        for line in lines:
-            stripped_line = line.rstrip()
+    except PermissionError:
+        log_message(logfile, f"Permission denied: {file_path}", level="error")
+    except Exception as e:
+        log_message(logfile, f"Error processing {file_path}: {e}", level="error")
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    return False
 
-            # Check for comments or blank lines
-            if not stripped_line or stripped_line.startswith('#'):
-                if in_multiline_value:
-                    stanza_lines[-1] += f"\n{line.rstrip()}"  # Preserve within multiline values
-                else:
-                    updated_lines.append(line)
-                continue
 
-            # Detect if the line starts a new stanza (strict rule: no spaces inside brackets)
-            stanza_match = re.match(r'^(?<!\\\n)\[([^\[\]]+)\]$', stripped_line)
-            if stanza_match and not in_multiline_value:
-                # Finalize the previous stanza, if any
-                if current_stanza:
-                    # Ensure 'disabled = 1' is the first parameter in the stanza
-                    updated_lines.append(f"[{current_stanza}]")
-                    if not any(l.strip().startswith('disabled =') for l in stanza_lines):
-                        updated_lines.append("disabled = 1")
-                    updated_lines.extend(stanza_lines)
-                    updated_lines.append("")  # Blank line between stanzas
-                    stanza_lines = []
-
-                # Start processing the new stanza
-                current_stanza = stanza_match.group(1)
-                log_message(logfile, f"Found stanza: {current_stanza}", level="info")
-                continue
 
-            # Handle multiline values (e.g., search = ...)
-            if in_multiline_value:
-                stanza_lines[-1] += f"\n{line.rstrip()}"  # Append to the previous parameter
-                if not stripped_line.endswith('\\'):  # Multiline ends without a backslash
-                    in_multiline_value = False
-                continue
 
-            # Detect a multiline value starting
-            if '=' in stripped_line and stripped_line.endswith('\\'):
-                stanza_lines.append(line.rstrip())  # Start of a multiline value
-                in_multiline_value = True
-                continue
 
-            # Regular key-value pair within a stanza
-            if '=' in stripped_line:
-                stanza_lines.append(line.rstrip())
-                continue
+def process_app(app_dir, args):
+    """Rewrite the savedsearches.conf files of an app. Returns a list of (file path, seconds), and False when a file could not be rewritten."""
+    timings = []
+    success = True
+    if os.path.isdir(app_dir):
+        # Look for savedsearches.conf in the app/default and app/local directory
+        for directory in ("default", "local"):
+            savedsearches_conf_path = os.path.join(app_dir, directory, "savedsearches.conf")
+            if os.path.isfile(savedsearches_conf_path):
+                st = time.perf_counter()
+                success = process_file(savedsearches_conf_path, args) and success
+                timings.append((savedsearches_conf_path, time.perf_counter() - st))
+    return timings, success
 
-        # Finalize the last stanza
-        if current_stanza:
-            updated_lines.append(f"[{current_stanza}]")
-            if not any(l.strip().startswith('disabled =') for l in stanza_lines):
-                updated_lines.append("disabled = 1")
-            updated_lines.extend(stanza_lines)
+def process_app_worker(app_dir, args):
+    result = process_app(app_dir, args)
+    # Worker processes exit without running the atexit hooks of the log writer
+    flush_logs()
+    return result
 
-        # Write back to the file
-        with open(file_path, 'w', encoding='utf-8') as file:
-            file.write('\n'.join(updated_lines).strip() + '\n')  # Ensure proper final newline
+# Forked worker processes find this module by its real name, __name__ is overwritten above
+process_app_worker.__module__ = "disabling_savedsearches"
 
-        log_message(logfile, f"Successfully processed and updated {file_path}", level="info")
+def fork_context():
+    """Return the fork multiprocessing context, or None on platforms without fork (Windows): the worker processes need the loaded modules."""
+    # Only loaded with -parallel, multiprocessing adds to the startup time
+    import multiprocessing
+    if "fork" not in multiprocessing.get_all_start_methods():
+        return None
+    return multiprocessing.get_context("fork")
 
-    except PermissionError:
-        log_message(logfile, f"Permission denied: {file_path}", level="error")
-    except Exception as e:
-        log_message(logfile, f"Error processing {file_path}: {e}", level="error")
+def process_apps(disabled_ss_dir, app_names, args):
+    """
+    Rewrite the savedsearches.conf files of the given apps, spread over a process pool with -parallel.
+    Returns the timings of the files and the names of the apps with a file that could not be rewritten.
+    """
+    app_dirs = [os.path.join(disabled_ss_dir, app_name) for app_name in app_names]
+    timings = []
+    failed_apps = set()
+    context = fork_context() if args.parallel else None
+    if args.parallel and context is None:
+        print("-parallel needs the fork start method, which this platform does not have. Processing the apps one by one.")
+        log_message(logfile, "-parallel is not available without the fork start method, processing the apps sequentially", level="info")
+    if context is not None:
+        workers = read_config_value("disable_workers", 0) or os.cpu_count() or 1
+        print(f"Processing {len(app_dirs)} apps with {workers} processes")
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+            for app_name, (app_timings, success) in zip(app_names, executor.map(process_app_worker, app_dirs, [args] * len(app_dirs))):
+                timings.extend(app_timings)
+                if not success:
+                    failed_apps.add(app_name)
+    else:
+        for app_name, app_dir in zip(app_names, app_dirs):
+            app_timings, success = process_app(app_dir, args)
+            timings.extend(app_timings)
+            if not success:
+                failed_apps.add(app_name)
+
+    for file_path, seconds in timings:
+        log_message(logfile, f"Processed {file_path} in {seconds:.3f} seconds", level="info")
+    if timings:
+        total = sum(seconds for _, seconds in timings)
+        print(f"Processed {len(timings)} savedsearches.conf files in {total:.2f} seconds of processing time. Slowest files:")
+        for file_path, seconds in sorted(timings, key=lambda timing: timing[1], reverse=True)[:5]:
+            print(f"  {seconds:.3f}s {file_path}")
+    if failed_apps:
+        print(f"Could not rewrite the savedsearches.conf files of {len(failed_apps)} apps (see error.log): {', '.join(sorted(failed_apps))}")
+    return timings, failed_apps
+
+def write_manifest(apps_dir, disabled_ss_dir, manifest_file, app_names, previous_apps, failed_apps=(), sources=None):
+    """
+    Record the source and output hashes of the given apps, keeping the entries of the other apps.
+    sources holds the (files, app_hash) of the apps that are already scanned, the other apps are scanned here.
+    Failed apps are left out, so the next incremental run processes them again.
+    """
+    apps = dict(previous_apps)
+    sources = sources or {}
+    for app_name in app_names:
+        if app_name in failed_apps:
+            apps.pop(app_name, None)
+            continue
+        if app_name in sources:
+            files, app_hash = sources[app_name]
+        else:
+            source_dir = os.path.join(apps_dir, app_name)
+            if not os.path.isdir(source_dir):
+                continue
+            files, app_hash = scan_app(source_dir, apps.get(app_name, {}).get("source"))
+        apps[app_name] = {"source": files, "source_hash": app_hash, "output": output_hashes(os.path.join(disabled_ss_dir, app_name))}
+    save_manifest(manifest_file, apps)
+
+def incremental_update(apps_dir, disabled_ss_dir, manifest_file, args):
+    """Re-stage and re-process only the apps whose source changed, and remove apps that no longer exist."""
+    previous_apps = load_manifest(manifest_file)
+    source_apps = {name for name in os.listdir(apps_dir) if os.path.isdir(os.path.join(apps_dir, name))}
+
+    # Remove output apps that no longer exist in the source
+    for app_name in os.listdir(disabled_ss_dir):
+        output_dir = os.path.join(disabled_ss_dir, app_name)
+        if os.path.isdir(output_dir) and app_name not in source_apps:
+            log_message(logfile, f"Removing {output_dir}, the app no longer exists in {apps_dir}", level="info")
+            shutil.rmtree(output_dir)
+            previous_apps.pop(app_name, None)
 
+    changed = []
+    apps = {}
+    # The hashes of the changed apps are recorded in the manifest once they are processed
+    sources = {}
+    for app_name in sorted(source_apps):
+        entry = previous_apps.get(app_name)
+        files, app_hash = scan_app(os.path.join(apps_dir, app_name), entry.get("source") if entry else None)
+        output_dir = os.path.join(disabled_ss_dir, app_name)
+        if app_is_current(entry, app_hash, output_dir):
+            apps[app_name] = dict(entry, source=files)
+            continue
+        changed.append(app_name)
+        sources[app_name] = (files, app_hash)
+        if os.path.exists(output_dir):
+            shutil.rmtree(output_dir)
 
+    print(f"Incremental run: {len(changed)} of {len(source_apps)} apps changed")
+    log_message(logfile, f"Incremental run, changed apps: {changed}", level="info")
 
+    stager = AppStager()
+    for app_name in changed:
+        if args.link:
+            stager.stage_app(os.path.join(apps_dir, app_name), os.path.join(disabled_ss_dir, app_name))
+        else:
+            shutil.copytree(os.path.join(apps_dir, app_name), os.path.join(disabled_ss_dir, app_name))
+    # Files next to the apps are always copied
+    for name in os.listdir(apps_dir):
+        if os.path.isfile(os.path.join(apps_dir, name)):
+            shutil.copy2(os.path.join(apps_dir, name), os.path.join(disabled_ss_dir, name))
 
+    _, failed_apps = process_apps(disabled_ss_dir, changed, args)
+    write_manifest(apps_dir, disabled_ss_dir, manifest_file, changed, apps, failed_apps, sources)
 
 def disabling_savedsearches(args):
     try:
         # Path to the directory containing Splunk apps
-        apps_dir = input("Enter the path to the directory containing Splunk apps: \n")
+        apps_dir = input("Enter the path to the directory containing Splunk apps: \n").rstrip(os.sep)
 
         # Create the "apps_ss_disabled" directory to copy apps
         disabled_ss_dir = os.path.join(os.path.dirname(apps_dir), "apps_ss_disabled")
 
-        # Copy the apps to apps_ss_disabled directory
-        if os.path.exists(disabled_ss_dir):
-            decision = input(f"Destination directory {disabled_ss_dir} already exists. Proceed and overwrite? (y/n): \n")
-            if decision.lower() == "y":
-                shutil.rmtree(disabled_ss_dir)
+        manifest_file = manifest_path(disabled_ss_dir)
+        if args.incremental and os.path.exists(disabled_ss_dir) and os.path.exists(manifest_file):
+            start_time = datetime.datetime.now()
+            # Only re-process the apps that changed since the last run
+            incremental_update(apps_dir, disabled_ss_dir, manifest_file, args)
+        else:
+            # Copy the apps to apps_ss_disabled directory
+            if os.path.exists(disabled_ss_dir):
+                decision = input(f"Destination directory {disabled_ss_dir} already exists. Proceed and overwrite? (y/n): \n")
+                if decision.lower() == "y":
+                    shutil.rmtree(disabled_ss_dir)
+                else:
+                    print("Exiting the script")
+                    exit(0)
+            # A manifest of an earlier run no longer describes the output
+            if os.path.exists(manifest_file):
+                os.remove(manifest_file)
+                    
+            start_time = datetime.datetime.now()
+            if args.link:
+                # Only the savedsearches.conf files are rewritten, all other files share their data with the original
+                print(f"Staging the apps directory to {disabled_ss_dir} with links")
+                counts = AppStager().stage_apps(apps_dir, disabled_ss_dir)
+                print(f"Files reflinked: {counts['reflinked']} | hardlinked: {counts['hardlinked']} | copied: {counts['copied']}")
             else:
-                print("Exiting the script")
-                exit(0)
-                
-        print(f"Copying the apps directory to {disabled_ss_dir}")
-        start_time = datetime.datetime.now()
-        shutil.copytree(apps_dir, disabled_ss_dir)
-
-        # Loop over all directories in the apps_ss_disabled directory
-        for app_name in os.listdir(disabled_ss_dir):
-            app_dir = os.path.join(disabled_ss_dir, app_name)
-            if os.path.isdir(app_dir):
-                # Look for savedsearches.conf in the app/default directory
-                savedsearches_conf_path = os.path.join(app_dir, "default", "savedsearches.conf")
-                if os.path.isfile(savedsearches_conf_path):
-                    process_file(savedsearches_conf_path, args)
-                # Look for savedsearches.conf in the app/local directory
-                savedsearches_conf_path = os.path.join(app_dir, "local", "savedsearches.conf")
-                if os.path.isfile(savedsearches_conf_path):
-                    process_file(savedsearches_conf_path, args)
-    except Exception as e:
-        print(f"An error occurred: {e}")
-    
-    # Calculate the runtime
+                print(f"Copying the apps directory to {disabled_ss_dir}")
+                shutil.copytree(apps_dir, disabled_ss_dir)
+
+            # Rewrite the savedsearches.conf files of all apps in the apps_ss_disabled directory
+            app_names = os.listdir(disabled_ss_dir)
+            _, failed_apps = process_apps(disabled_ss_dir, app_names, args)
+
+            if args.incremental:
+                write_manifest(apps_dir, disabled_ss_dir, manifest_file, app_names, {}, failed_apps)
+
+        # Calculate the runtime
         end_time = datetime.datetime.now()
         runtime = (end_time - start_time).seconds
 
@@ -148,4 +264,7 @@ def disabling_savedsearches(args):
         print(f"Script completed in {runtime} seconds.")
         print(f"Logfiles are created in the working directory of the script")
         
-        return
\ No newline at end of file
+        return
+
+    except Exception as e:
+        print(f"An error occurred: {e}")
\ No newline at end of file
@@ -0,0 +1,148 @@
+### DISCLAIMER
+# USE THE SCRIPT AT YOUR OWN RISK
+# ALWAYS VERIFY RESULTS
+
+import os, sys
+import json
+import datetime
+import itertools
+
+# import custom lib
+sys.path.append(os.path.join(os.path.dirname(__file__), "lib"))
+
+from script_logger import log_message
+from utils import call_data, split_api_urls, read_config_value, ask_for_input
+from call_journal import payload_hash, open_journal, close_journal
+from api_caller import run_calls, syntax_check, setup_api_caller, report_connection_stats, report_target_stats
+from run_metrics import reset_metrics, write_run_report
+
+__name__ = "execution_plan.py"
+__author__ = "Michel de Jong"
+logfile = "rest_api_runner"
+
+PLAN_VERSION = 1
+
+def plan_entry(call, level=None):
+    """
+    Return a call as a plan entry: method, URL, payload (with the XML of views read from disk), payload hash
+    and the follow-up call that depends on it. The token is not written to the plan.
+    """
+    data = call_data(call)
+    entry = {"method": "POST", "url": call["api_url"], "app": call["app_name"], "stanza": call["stanza_name"], "data": data, "payload_hash": payload_hash(data)}
+    if level is not None:
+        # Calls of a level only depend on calls of lower levels
+        entry["level"] = level
+    if call.get("retry_not_found"):
+        entry["retry_not_found"] = True
+    if call.get("then"):
+        entry["then"] = plan_entry(call["then"])
+    return entry
+
+def call_from_entry(entry, headers):
+    """Return the call of a plan entry, with the headers of the run."""
+    call = {"api_url": entry["url"], "app_name": entry["app"], "stanza_name": entry["stanza"], "headers": headers, "data": entry["data"]}
+    if entry.get("retry_not_found"):
+        call["retry_not_found"] = True
+    if entry.get("then"):
+        call["then"] = call_from_entry(entry["then"], headers)
+    return call
+
+class PlanWriter:
+    """
+    Write the calls of a run to a JSONL plan file instead of sending them: a header line, one line per call
+    in the order of the dependency levels, and an end line with the number of calls.
+    The plan is written to a temporary file and only replaces path when it is complete.
+    """
+    def __init__(self, path, run_name, api_urls):
+        self.path = path
+        self.temp_path = f"{path}.tmp"
+        self.calls = 0
+        self.file = open(self.temp_path, 'w', encoding='utf-8')
+        self.write_line({"plan": run_name, "version": PLAN_VERSION, "created_at": datetime.datetime.now().isoformat(), "targets": api_urls})
+
+    def write_line(self, line):
+        self.file.write(json.dumps(line, separators=(",", ":")) + "\n")
+
+    def write_calls(self, calls, level=0):
+        for call in calls:
+            self.write_line(plan_entry(call, level))
+            self.calls += 1
+
+    def close(self):
+        self.write_line({"end": True, "calls": self.calls})
+        self.file.close()
+        os.replace(self.temp_path, self.path)
+        print(f"Plan with {self.calls} API calls written to {self.path}")
+        log_message(logfile, f"Plan with {self.calls} API calls written to {self.path}", level="info")
+
+    def abort(self):
+        self.file.close()
+        os.remove(self.temp_path)
+
+def read_plan_header(path):
+    """Return the header and end line of a plan file. Raises ValueError for an incomplete or unknown plan."""
+    with open(path, 'rb') as file:
+        header = json.loads(file.readline())
+        # The end line is the last line, read it without reading the calls
+        file.seek(0, os.SEEK_END)
+        file.seek(max(0, file.tell() - 4096))
+        last_line = file.read().splitlines()[-1]
+    end = json.loads(last_line)
+    if header.get("version") != PLAN_VERSION or "plan" not in header:
+        raise ValueError(f"{path} is not a plan of this version")
+    if not end.get("end"):
+        raise ValueError(f"{path} is incomplete, create the plan again")
+    return header, end
+
+def iter_plan(path, headers):
+    """Yield (level, call) for every call of a plan file, one line at a time."""
+    with open(path, 'r', encoding='utf-8') as file:
+        next(file)
+        for line in file:
+            entry = json.loads(line)
+            if entry.get("end"):
+                return
+            yield entry.get("level", 0), call_from_entry(entry, headers)
+
+def apply_plan(args):
+    """Send the calls of a plan file level by level, without scanning or parsing the apps."""
+    try:
+        header, end = read_plan_header(args.apply)
+        api_urls = split_api_urls(header.get("targets", []))
+        print(f"Plan: {header['plan']} created at {header.get('created_at')} | {end['calls']} API calls | Targets: {', '.join(api_urls)}")
+
+        max_api_calls = read_config_value("max_api_calls_second", 10)
+        if max_api_calls <= 0:
+            raise ValueError("max_api_calls_second must be a positive integer")
+        token = ask_for_input(read_config_value("token", ""), "authentication token", is_password=True)
+        headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
+
+        start_time = datetime.datetime.now()
+        reset_metrics()
+        if args.dummy is False:
+            for target_url in api_urls:
+                syntax_check(target_url)
+        log_message(logfile, f"Applying plan {args.apply} with {end['calls']} API calls", level="info")
+
+        setup_api_caller(max_api_calls)
+        if args.dummy is False:
+            open_journal(read_config_value("journal_path", "rest_api_journal.sqlite"))
+
+        # A level starts when the calls of the previous level are done
+        for level, entries in itertools.groupby(iter_plan(args.apply, headers), key=lambda item: item[0]):
+            log_message(logfile, f"Applying level {level}", level="info")
+            run_calls((call for _, call in entries), args, max_api_calls)
+
+        runtime = (datetime.datetime.now() - start_time).seconds
+        if args.dummy is False and not args.async_engine:
+            report_connection_stats()
+        report_target_stats()
+        close_journal()
+        if args.dummy is False:
+            write_run_report(f"apply_{header['plan']}", read_config_value("metrics_directory", ""))
+        print(f"Script completed in {runtime} seconds.")
+        log_message(logfile, f"Plan {args.apply} applied in {runtime} seconds.", level="info")
+
+    except (OSError, ValueError) as e:
+        print(f"Cannot apply the plan: {e}")
+        log_message(logfile, f"Cannot apply the plan {args.apply}: {e}", level="error")
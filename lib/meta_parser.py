@@ -3,7 +3,7 @@
 # ALWAYS VERIFY RESULTS
 
 import os, sys
-import configparser
+import re
 import urllib.parse
 from collections import defaultdict
 
@@ -11,12 +11,22 @@ from collections import defaultdict
 sys.path.append(os.path.join(os.path.dirname(__file__), "lib"))
 
 from script_logger import log_message
-from utils import endpoint_mapping
+from object_registry import endpoint_for, encode_object_name
+from conf_parser import parse_conf
 
 __name__ = "meta_parser.py"
 __author__ = "Michel de Jong"
 logfile = "meta_parser"
 
+# Metadata files of an app, lowest precedence first
+META_LAYERS = ("default.meta", "local.meta")
+
+# access = read : [ * ], write : [ admin, power ]
+ACCESS_PATTERN = re.compile(r'(?P<permission>read|write)\s*:\s*\[(?P<roles>[^\]]*)\]')
+
+# ACL of an object created in the nobody namespace of an app
+DEFAULT_ACL = {"owner": "nobody", "sharing": "app"}
+
 def determine_scope(raw_stanza):
     """
     Determine the scope of the stanza:
@@ -31,28 +41,33 @@ def determine_scope(raw_stanza):
         return "conf_file", parts[0], None
     return "object", parts[0], parts[1]
 
+def parse_access(value):
+    """Split an access setting (read : [ * ], write : [ admin ]) into a dictionary of permission -> comma separated roles."""
+    access = {}
+    for match in ACCESS_PATTERN.finditer(value):
+        roles = [role.strip() for role in match.group("roles").split(",") if role.strip()]
+        access[match.group("permission")] = ",".join(roles)
+    return access
+
 def parse_meta(file_path):
     """
     Parse metadata from a file and prepare it for API calls.
     """
-    config = configparser.ConfigParser(strict=False, interpolation=None)
-    config.read(file_path)
-
     parsed_data = []
-    for section in config.sections():
+    for section, settings in parse_conf(file_path).items():
         raw_stanza = urllib.parse.unquote(section)
         scope, conf_file, object_name = determine_scope(raw_stanza)
 
-        # Determine the API endpoint
-        api_endpoint = endpoint_mapping().get(conf_file, None)
-        if not api_endpoint:
-            continue  # Skip unknown object types
+        # Determine the API endpoint, None for the app-wide stanza and for object types without an endpoint
+        api_endpoint = endpoint_for(conf_file) if conf_file else None
 
         # Prepare the data dictionary for API calls
         parameters = defaultdict(dict)
-        for key, value in config.items(section):
+        for key, value in settings.items():
+            if key == "access":
+                parameters["access"] = parse_access(value)
             # Split keys like `perms.read` into nested dictionaries
-            if "." in key:
+            elif "." in key:
                 top_key, sub_key = key.split(".", 1)
                 parameters[top_key][sub_key] = value
             else:
@@ -61,6 +76,7 @@ def parse_meta(file_path):
         api_data = {
             "stanza_name": raw_stanza,
             "scope": scope,
+            "conf_file": conf_file,
             "api_endpoint": api_endpoint,
             "object_name": object_name,
             "parameters": dict(parameters),
@@ -69,6 +85,68 @@ def parse_meta(file_path):
 
     return parsed_data
 
+def acl_parameters(parameters):
+    """Return the ACL settings of parsed .meta parameters as REST API values (owner, sharing, perms.read, perms.write)."""
+    acl = {}
+    access = parameters.get("access", {})
+    if "read" in access:
+        acl["perms.read"] = access["read"]
+    if "write" in access:
+        acl["perms.write"] = access["write"]
+    if "owner" in parameters:
+        acl["owner"] = parameters["owner"]
+    if "export" in parameters:
+        acl["sharing"] = "global" if parameters["export"] == "system" else "app"
+    return acl
+
+def acl_payload(acl):
+    """Return the data of an ACL update. The API requires the owner and sharing, also when only the permissions change."""
+    return {**DEFAULT_ACL, **acl}
+
+class AppAcls:
+    """
+    Effective ACL settings of the .meta stanzas of an app (default.meta, overridden by local.meta).
+    Objects inherit the app-wide [] stanza, overridden by the stanza of their type (e.g. [savedsearches]).
+    """
+    def __init__(self, stanzas=None):
+        self.stanzas = stanzas or {}
+
+    def inherited(self, conf_file):
+        """Return the ACL settings an object of a type inherits."""
+        return {**self.stanzas.get("", {}), **self.stanzas.get(conf_file, {})}
+
+    def object_acl(self, conf_file, object_name):
+        """
+        Return the data of the ACL update of an object, or None when its effective ACL is the ACL the create call gives it.
+        The create call shares the object with the app (DEFAULT_ACL) with the permissions of the target app, which are not
+        known here, so an object with permissions in its effective ACL is always updated.
+        """
+        effective = {**self.inherited(conf_file), **self.stanzas.get(f"{conf_file}/{object_name}", {})}
+        payload = acl_payload(effective)
+        if payload == DEFAULT_ACL:
+            return None
+        return payload
+
+def load_app_acls(app_path):
+    """Parse metadata/default.meta and metadata/local.meta of an app."""
+    stanzas = {}
+    for meta_file in META_LAYERS:
+        meta_path = os.path.join(app_path, "metadata", meta_file)
+        if not os.path.exists(meta_path):
+            continue
+        try:
+            for data in parse_meta(meta_path):
+                acl = acl_parameters(data["parameters"])
+                settings = stanzas.setdefault(data["stanza_name"], {})
+                # access is one setting: local.meta replaces both permissions of default.meta
+                if "perms.read" in acl or "perms.write" in acl:
+                    settings.pop("perms.read", None)
+                    settings.pop("perms.write", None)
+                settings.update(acl)
+        except Exception as e:
+            log_message(logfile, f"Error parsing {meta_path}: {e}", level="error")
+    return AppAcls(stanzas)
+
 def prepare_api_calls(parsed_data, api_url, app_name):
     """
     Prepare API calls for the `api_caller.py` script.
@@ -81,10 +159,12 @@ def prepare_api_calls(parsed_data, api_url, app_name):
         api_endpoint = data["api_endpoint"]
         object_name = data["object_name"]
         parameters = data["parameters"]
+        if not api_endpoint:
+            continue  # Skip unknown object types
 
         # Build the API URL
         if scope == "object":
-            encoded_stanza = urllib.parse.quote(object_name).replace("/", "%252F")
+            encoded_stanza = encode_object_name(object_name)
             api_url_full = f"{api_url}/{api_endpoint}/{encoded_stanza}/acl"
         elif scope == "conf_file":
             api_url_full = f"{api_url}/{api_endpoint}"
@@ -95,18 +175,7 @@ def prepare_api_calls(parsed_data, api_url, app_name):
             continue  # Skip if no valid scopea
 
         # Prepare the payload
-        payload = {}
-        if "access" in parameters:
-            access = parameters["access"]
-            if "read" in access:
-                payload["perms.read"] = access["read"]
-            if "write" in access:
-                payload["perms.write"] = access["write"]
-        if "owner" in parameters:
-            payload["owner"] = parameters["owner"]
-        if "export" in parameters:
-            sharing = "global" if parameters["export"] == "system" else "app"
-            payload["sharing"] = sharing
+        payload = acl_payload(acl_parameters(parameters))
 
         # Add to API calls list
         api_calls.append({
@@ -2,20 +2,27 @@
 # USE THE SCRIPT AT YOUR OWN RISK
 # ALWAYS VERIFY RESULTS
 
-import importlib
-import subprocess
+import importlib.util
+
+def module_available(module):
+    """Check if a module can be imported, without importing it (only the parent package of a submodule is imported)."""
+    try:
+        return importlib.util.find_spec(module) is not None
+    except (ImportError, ValueError):
+        return False
 
 def check_modules(modules):
     for module in modules:
-        try:
-            importlib.import_module(module)
-        except ImportError:
+        if not module_available(module):
             print(f"{module} is not installed.")
             decision = input(f"Do you want to install {module}? (y/n): \n")
             if decision.lower() == "y":
                 print(f"Installing...")
+                import subprocess
                 try:
                     subprocess.check_call(['pip3', 'install', module])
+                    # Make the new package visible to the running interpreter
+                    importlib.invalidate_caches()
                 except Exception as e:
                     print(f"An unexpected error occurred: {e}")
                     print("Exiting the script")
@@ -23,4 +30,4 @@ def check_modules(modules):
             else:
                 print("Exiting the script")
                 exit(0)
-            print(f"{module} has been successfully installed.")
\ No newline at end of file
+            print(f"{module} has been successfully installed.")
@@ -0,0 +1,154 @@
+### DISCLAIMER
+# USE THE SCRIPT AT YOUR OWN RISK
+# ALWAYS VERIFY RESULTS
+
+import os, sys
+import threading
+import urllib.parse
+from collections import namedtuple
+
+# import custom lib
+sys.path.append(os.path.join(os.path.dirname(__file__), "lib"))
+
+from script_logger import log_message
+from utils import endpoint_mapping
+
+__name__ = "object_registry.py"
+__author__ = "Michel de Jong"
+logfile = "rest_api_runner"
+
+# Tag of the objects in each .conf file
+CONF_FILE_TAGS = {
+    "savedsearches.conf": "savedsearches",
+    "macros.conf": "macros",
+    "tags.conf": "tags",
+    "eventtypes.conf": "eventtypes",
+    "workflow_actions.conf": "workflow_actions",
+    "datamodels.conf": "datamodels",
+    "transforms.conf": "transforms",
+    "collections.conf": "transforms",
+}
+
+# props.conf objects are typed by the prefix of their key
+PROPS_KEY_TAGS = (
+    ("EXTRACT", "props_extract"),
+    ("REPORT", "props_extract"),
+    ("EVAL", "props_eval"),
+    ("FIELDALIAS", "props_fieldalias"),
+    ("LOOKUP", "props_lookup"),
+    ("rename", "props_sourcetype_rename"),
+)
+
+# Tag of the XML files in each directory below app/local or app/default
+XML_DIRECTORY_TAGS = {
+    "data/ui/views": "views",
+    "data/ui/panels": "panels",
+    "data/ui/nav": "nav",
+}
+
+# Object types that must exist before an object type can be created, e.g. eventtypes use macros
+# and props LOOKUP-/REPORT- settings refer to transforms
+PROPS_DEPENDENCIES = ("transforms", "transforms_lookup")
+TAG_DEPENDENCIES = {
+    "eventtypes": ("macros",),
+    "tags": ("eventtypes",),
+    "workflow_actions": ("eventtypes",),
+    "datamodels": ("macros", "eventtypes", "tags"),
+    "savedsearches": ("macros", "eventtypes", "tags", "datamodels"),
+    "props": PROPS_DEPENDENCIES,
+    "props_lookup": PROPS_DEPENDENCIES,
+    "props_extract": PROPS_DEPENDENCIES,
+    "props_eval": PROPS_DEPENDENCIES,
+    "props_fieldalias": PROPS_DEPENDENCIES,
+    "props_sourcetype_rename": PROPS_DEPENDENCIES,
+    "panels": ("savedsearches",),
+    "views": ("savedsearches", "panels", "datamodels"),
+    "nav": ("views", "savedsearches"),
+}
+
+# - endpoint: REST endpoint below servicesNS/nobody/<app>
+# - url_template: URL of the endpoint, with {api_url} and {app_name} placeholders
+ObjectType = namedtuple("ObjectType", ["tag", "endpoint", "url_template"])
+
+object_types = None
+tag_levels = None
+props_key_cache = {}
+registry_lock = threading.Lock()
+
+def load_registry():
+    """Load endpoint_mapping.json once and build the object types."""
+    global object_types
+    if object_types is not None:
+        return object_types
+    with registry_lock:
+        if object_types is None:
+            types = {}
+            for tag, endpoint in (endpoint_mapping() or {}).items():
+                types[tag] = ObjectType(tag, endpoint, "{api_url}/servicesNS/nobody/{app_name}/" + endpoint)
+            object_types = types
+            log_message(logfile, f"Loaded {len(types)} object types", level="info")
+    return object_types
+
+def creation_levels():
+    """
+    Return the creation level of every known tag. Objects of a level only depend on objects of lower levels,
+    so all objects of a level can be created concurrently once the lower levels are done.
+    """
+    global tag_levels
+    if tag_levels is not None:
+        return tag_levels
+    tags = set(load_registry()) | set(TAG_DEPENDENCIES)
+    levels = {}
+    remaining = set(tags)
+    level = 0
+    while remaining:
+        # Tags whose dependencies all have a level
+        ready = {tag for tag in remaining if all(dependency in levels or dependency not in tags for dependency in TAG_DEPENDENCIES.get(tag, ()))}
+        if not ready:
+            log_message(logfile, f"Circular dependencies between {', '.join(sorted(remaining))}, creating them last", level="error")
+            ready = remaining
+        for tag in ready:
+            levels[tag] = level
+        remaining -= ready
+        level += 1
+    tag_levels = levels
+    return tag_levels
+
+def creation_level(tag):
+    """Return the creation level of a tag, 0 for unknown tags."""
+    return creation_levels().get(tag, 0)
+
+def endpoint_for(tag):
+    """Return the REST endpoint of an object type, or None for unknown types."""
+    object_type = load_registry().get(tag)
+    return object_type.endpoint if object_type else None
+
+def object_url(tag, api_url, app_name):
+    """Return the URL of the collection of an object type in an app, or None for unknown types."""
+    object_type = load_registry().get(tag)
+    if object_type is None:
+        return None
+    return object_type.url_template.format(api_url=api_url, app_name=app_name)
+
+def encode_object_name(name):
+    # Slashes in object names are double encoded by the Splunk REST API
+    return urllib.parse.quote(name).replace("/", "%252F")
+
+def tag_for_conf(filename, key=None):
+    """Return the tag of a .conf file. For props.conf the tag depends on the key, None when not recognised."""
+    if filename != "props.conf":
+        return CONF_FILE_TAGS.get(filename)
+    if key is None:
+        return None
+    tag = props_key_cache.get(key)
+    if tag is None and key not in props_key_cache:
+        for prefix, prefix_tag in PROPS_KEY_TAGS:
+            if key.startswith(prefix):
+                tag = prefix_tag
+                break
+        props_key_cache[key] = tag
+    return tag
+
+def tag_for_xml(directory):
+    """Return the tag of the XML files in a directory relative to app/local, e.g. data/ui/views."""
+    return XML_DIRECTORY_TAGS.get(directory.replace(os.sep, "/").strip("/"))
@@ -0,0 +1,129 @@
+### DISCLAIMER
+# USE THE SCRIPT AT YOUR OWN RISK
+# ALWAYS VERIFY RESULTS
+
+import os, sys
+import json
+import time
+import hashlib
+import threading
+
+# import custom lib
+sys.path.append(os.path.join(os.path.dirname(__file__), "lib"))
+
+from script_logger import log_message
+
+__name__ = "parse_cache.py"
+__author__ = "Michel de Jong"
+logfile = "rest_api_runner"
+
+# Bump when the output of a cached parser changes, to invalidate older cache entries
+CACHE_VERSION = 3
+
+# Parsed .conf files are cached in the working directory of the script, next to the logs
+cache_directory = "parse_cache"
+cache_enabled = True
+cache_use_hash = False
+
+# Counters
+cache_hits = 0
+cache_misses = 0
+time_saved = 0.0
+cache_lock = threading.Lock()
+
+def configure_parse_cache(enabled=True, use_hash=False, directory="parse_cache"):
+    """
+    - enabled: use the cache at all
+    - use_hash: also compare a sha256 of the file content, for filesystems with unreliable mtimes
+    """
+    global cache_enabled, cache_use_hash, cache_directory
+    cache_enabled = enabled
+    cache_use_hash = use_hash
+    cache_directory = directory
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def cache_path(path, namespace):
+    key = hashlib.sha1(f"{namespace}:{os.path.abspath(path)}".encode("utf-8")).hexdigest()
+    return os.path.join(cache_directory, namespace, f"{key}.json")
+
+def run_parser(path, parser, default):
+    """Return (parser(path), True), or (default, False) when the parser raised an error."""
+    try:
+        return parser(path), True
+    except Exception as e:
+        log_message(logfile, f"Error parsing {path}: {e}", level="error")
+        return default, False
+
+def cached_parse(path, namespace, parser, default=None):
+    """
+    Return parser(path), reusing the result of an earlier run when the file did not change.
+    A cache entry is valid when the path, size and mtime (and optionally the content hash) match.
+    namespace separates the results of different parsers for the same file.
+    When the parser raises an error, default is returned and no cache entry is written, so the file
+    is parsed again in the next run (e.g. after its permissions were fixed, which does not change the mtime).
+    """
+    global cache_hits, cache_misses, time_saved
+
+    if not cache_enabled:
+        return run_parser(path, parser, default)[0]
+    try:
+        stat = os.stat(path)
+    except OSError:
+        # Nothing to cache for files that do not exist
+        return run_parser(path, parser, default)[0]
+
+    entry_path = cache_path(path, namespace)
+    content_hash = file_hash(path) if cache_use_hash else None
+
+    try:
+        st = time.perf_counter()
+        with open(entry_path, 'r', encoding='utf-8') as file:
+            entry = json.load(file)
+        if (entry.get("version") == CACHE_VERSION and entry.get("path") == os.path.abspath(path) and entry.get("size") == stat.st_size
+                and entry.get("mtime_ns") == stat.st_mtime_ns and entry.get("sha256") == content_hash):
+            with cache_lock:
+                cache_hits += 1
+                time_saved += max(0.0, entry.get("parse_seconds", 0.0) - (time.perf_counter() - st))
+            return entry["data"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    st = time.perf_counter()
+    data, parsed = run_parser(path, parser, default)
+    parse_seconds = time.perf_counter() - st
+    with cache_lock:
+        cache_misses += 1
+    if not parsed:
+        return data
+
+    try:
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        entry = {
+            "version": CACHE_VERSION,
+            "path": os.path.abspath(path),
+            "size": stat.st_size,
+            "mtime_ns": stat.st_mtime_ns,
+            "sha256": content_hash,
+            "parse_seconds": parse_seconds,
+            "data": data,
+        }
+        # Write to a temporary file first, so an interrupted run never leaves a broken entry
+        temp_path = f"{entry_path}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump(entry, file)
+        os.replace(temp_path, entry_path)
+    except Exception as e:
+        log_message(logfile, f"Error writing parse cache for {path}: {e}", level="error")
+    return data
+
+def report_cache_stats():
+    if not cache_enabled:
+        return
+    print(f"Parse cache - Hits: {cache_hits} | Misses: {cache_misses} | Time saved: {time_saved:.2f}s")
+    log_message(logfile, f"Parse cache hits: {cache_hits}, misses: {cache_misses}, time saved: {time_saved:.2f}s", level="info")
@@ -0,0 +1,129 @@
+### DISCLAIMER
+# USE THE SCRIPT AT YOUR OWN RISK
+# ALWAYS VERIFY RESULTS
+
+import os, sys
+import time
+import threading
+import datetime
+import email.utils
+import urllib.parse
+
+# import custom lib
+sys.path.append(os.path.join(os.path.dirname(__file__), "lib"))
+
+from script_logger import log_message
+
+__name__ = "rate_limiter.py"
+__author__ = "Michel de Jong"
+logfile = "rest_api_runner"
+
+# Status codes that tell us the stack is throttling us
+THROTTLE_STATUS_CODES = {429, 503}
+# Seconds in which further throttled responses do not lower the rate again
+THROTTLE_WINDOW = 1.0
+
+class TokenBucket:
+    """
+    Token bucket shared by all workers calling the same host.
+    - rate: calls per second that are allowed on average
+    - burst: calls that may be sent back-to-back after an idle period
+    The rate is halved when the stack throttles and slowly recovers afterwards.
+    """
+    def __init__(self, rate, burst=1, min_rate=0.5, recovery_delay=5.0):
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.burst = max(1, int(burst))
+        self.min_rate = min(float(min_rate), self.max_rate)
+        self.recovery_delay = recovery_delay
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.last_throttle = 0.0
+        self.last_recovery = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        # 'updated' lies in the future while the bucket is paused
+        elapsed = now - self.updated
+        if elapsed > 0:
+            self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+            self.updated = now
+
+    def reserve(self):
+        """Take a token and return the number of seconds to wait before sending the call."""
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= 1
+            wait = max(0.0, self.updated - now)
+            if self.tokens < 0:
+                wait += -self.tokens / self.rate
+            return wait
+
+    def acquire(self):
+        """Block until the call is allowed to be sent."""
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    def on_response(self, status_code, retry_after=None):
+        """Adapt the rate to the response of the stack."""
+        pause = parse_retry_after(retry_after)
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            if status_code in THROTTLE_STATUS_CODES or pause is not None:
+                # Calls that were already in flight report the same throttle, back off once per window
+                if now - self.last_throttle >= THROTTLE_WINDOW:
+                    self.rate = max(self.min_rate, self.rate / 2)
+                if pause is None:
+                    pause = 1.0 / self.rate
+                # Stop handing out tokens until the pause is over
+                self.tokens = min(self.tokens, 0.0)
+                self.updated = max(self.updated, now + pause)
+                self.last_throttle = now
+                return True
+            if self.rate < self.max_rate and now - self.last_throttle >= self.recovery_delay and now - self.last_recovery >= 1.0:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * 0.1)
+                self.last_recovery = now
+            return False
+
+def parse_retry_after(value):
+    """Convert a Retry-After header (seconds or HTTP date) to seconds."""
+    if value is None or value == "":
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+        return max(0.0, (retry_at - datetime.datetime.now(retry_at.tzinfo)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+# One bucket per target host, shared by all worker threads
+limiters = {}
+limiter_rate = 10
+limiter_burst = 1
+limiter_lock = threading.Lock()
+
+def configure_rate_limiter(max_api_calls, burst=1):
+    global limiter_rate, limiter_burst
+    with limiter_lock:
+        limiter_rate = max_api_calls
+        limiter_burst = burst
+        limiters.clear()
+
+def get_rate_limiter(api_url):
+    """Return the token bucket for the host of the given API url."""
+    host = urllib.parse.urlparse(api_url).netloc
+    limiter = limiters.get(host)
+    if limiter is None:
+        with limiter_lock:
+            limiter = limiters.get(host)
+            if limiter is None:
+                limiter = TokenBucket(limiter_rate, limiter_burst)
+                limiters[host] = limiter
+                log_message(logfile, f"Rate limit for {host}: {limiter_rate} calls/second, burst {limiter_burst}", level="info")
+    return limiter
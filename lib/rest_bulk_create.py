@@ -3,91 +3,69 @@
 # ALWAYS VERIFY RESULTS
 
 import os
-import re
 import datetime
-import time
 import json
+import queue
+import threading
 from concurrent.futures import ThreadPoolExecutor
 
 from script_logger import log_message
-from api_caller import build_create_url, syntax_check
-from utils import get_config
-from meta_parser import parse_meta
+from api_caller import prepare_create_call, run_calls, syntax_check, setup_api_caller, report_connection_stats, report_target_stats
+from utils import get_config, read_config_value, split_api_urls
+from meta_parser import load_app_acls
+from execution_plan import PlanWriter
+from conf_parser import iter_stanzas
+from object_registry import tag_for_conf, tag_for_xml, creation_level, creation_levels
+from call_journal import open_journal, close_journal
+from parse_cache import cached_parse, configure_parse_cache, report_cache_stats
+from stanza_model import compact_stanzas, reset_stanza_pools
+from conf_merge import merge_layers, APP_LAYERS, DEFAULT_STANZA
+from run_metrics import reset_metrics, phase_timer, write_run_report
 
 __name__ = "rest_bulk_update.py"
 __author__ = "Michel de Jong"
 logfile = "rest_api_runner"
 
 def parse_files(path):
-    """Parse .conf and XML files into a dictionary."""
+    """Parse .conf and XML files into a dictionary, reusing the cached result when the file did not change."""
+    with phase_timer("parse"):
+        params_dict, tag = cached_parse(path, "parse_files", read_files, ({}, None))
+        # Compact stanzas with shared keys and values
+        return compact_stanzas(params_dict), tag
+
+def read_files(path):
+    """Parse .conf and XML files into a dictionary. Raises an error when the file cannot be read or parsed."""
     params_dict = {}
-    current_section = None
     tag = None
     formatted_data ={}
 
-    try:
-        if os.path.exists(path):
-            # Get the filename
-            filename = os.path.basename(path)
-
-            with open(path, 'r', encoding='utf-8') as file:
-                for line in file:
-                    line = line.strip()
-                    if line.startswith('#') or not line:
-                        continue
-
-                    # Match section headers (stanzas) in .conf files
-                    stanza_match = re.match(r'^\[(.*)\]$', line)
-                    if stanza_match:
-                        current_section = stanza_match.group(1)
-                        params_dict[current_section] = {}
-
-                    elif '=' in line:
-                        if current_section:
-                            key, value = map(str.strip, line.split('=', 1))
-                            params_dict[current_section][key] = value
-
-                            # Assign tag based on filename (exact match)
-                            if filename == "savedsearches.conf":
-                                tag = "savedsearches"
-                                # Handle special case of changing key names to match API requirements
-                                if "enableSched" in params_dict[current_section]:
-                                    params_dict[current_section]['is_scheduled'] = params_dict[current_section].pop('enableSched')
-                            elif filename == "macros.conf":
-                                tag = "macros"
-                            elif filename == "tags.conf":
-                                tag = "tags"
-                            elif filename == "eventtypes.conf":
-                                tag = "eventtypes"
-                            elif filename == "workflow_actions.conf":
-                                tag = "workflow_actions"
-                            elif filename == "datamodels.conf":
-                                tag = "datamodels"
-                                # Special handling for acceleration parameters
-                                if key.startswith("acceleration."):
-                                    # Remove "acceleration." prefix for JSON structure
-                                    param_name = key.split("acceleration.", 1)[1]
-                                    formatted_data.setdefault(current_section, {}).setdefault("acceleration", {})[param_name] = value
-                            elif filename == "transforms.conf":
-                                tag = "transforms"
-                            elif filename == "collections.conf":
-                                tag = "transforms"
-                            elif filename == "props.conf":
-                                # Special handling for props.conf
-                                if 'EXTRACT' in key or 'REPORT' in key:
-                                    tag = "props_extract"
-                                elif 'EVAL' in key:
-                                    tag = "props_eval"
-                                elif 'FIELDALIAS' in key:
-                                    tag = "props_fieldalias"
-                                elif 'LOOKUP' in key:
-                                    tag = "props_lookup"
-                                elif 'rename' in key:
-                                    tag = "props_sourcetype_rename"
+    if os.path.exists(path):
+        # Get the filename
+        filename = os.path.basename(path)
+
+        # Tag based on filename (exact match), props.conf is typed per key
+        file_tag = tag_for_conf(filename)
+
+        for current_section, settings in iter_stanzas(path, global_stanza=DEFAULT_STANZA):
+            params_dict.setdefault(current_section, {})
+            for key, value in settings.items():
+                params_dict[current_section][key] = value
+
+                if filename == "props.conf":
+                    tag = tag_for_conf(filename, key) or tag
+                elif file_tag:
+                    tag = file_tag
+
+                # Special handling for acceleration parameters
+                if tag == "datamodels" and key.startswith("acceleration."):
+                    # Remove "acceleration." prefix for JSON structure
+                    param_name = key.split("acceleration.", 1)[1]
+                    formatted_data.setdefault(current_section, {}).setdefault("acceleration", {})[param_name] = value
+
+            # Handle special case of changing key names to match API requirements
+            if tag == "savedsearches" and "enableSched" in params_dict[current_section]:
+                params_dict[current_section]['is_scheduled'] = params_dict[current_section].pop('enableSched')
 
-    except Exception as e:
-        log_message(logfile, f"Error parsing {path}: {e}", level="error")
-    
     # Post-process acceleration data for API compatibility
     if tag == "datamodels":
         for stanza, data in formatted_data.items():
@@ -97,78 +75,248 @@ def parse_files(path):
 
     return params_dict, tag
 
-def collect_files(location):
-    """Recursively collect relevant files from app/local directories and their app names."""
-    files = []
-    for app in os.listdir(location):
-        app_path = os.path.join(location, app)
-        if os.path.isdir(app_path):
-            local_path = os.path.join(app_path, "local")
-            if os.path.exists(local_path):
-                for root, _, filenames in os.walk(local_path):
-                    for filename in filenames:
-                        if filename.endswith(('.conf', '.xml')):
-                            # For XML files, determine the tag based on their location
-                            if filename.endswith('.xml'):
-                                if 'data/ui/view' in root:
-                                    tag = 'views'
-                                elif 'data/ui/panels' in root:
-                                    tag = 'panels'
-                                elif 'data/ui/nav' in root:
-                                    tag = 'nav'
-                            # Append a tuple (file_name, app_name, full_path, tag)
-                            files.append((filename, app, root, tag))
-    return files
+def scan_directory(directory, layer_path):
+    """
+    Yield (relative_directory, file_name, tag) for the .conf and XML files below a default or local directory, as they are found.
+    Files without an object type (e.g. app.conf, or XML files outside the view, panel and nav directories) are skipped, they are not parsed.
+    """
+    relative_directory = os.path.relpath(directory, layer_path)
+    try:
+        with os.scandir(directory) as entries:
+            subdirectories = []
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirectories.append(entry.path)
+                elif entry.name.endswith('.conf'):
+                    # props.conf objects are typed per key when the file is parsed
+                    if entry.name == "props.conf" or tag_for_conf(entry.name):
+                        yield relative_directory, entry.name, None
+                elif entry.name.endswith('.xml'):
+                    # For XML files, determine the tag based on their location
+                    tag = tag_for_xml(relative_directory)
+                    if tag:
+                        yield relative_directory, entry.name, tag
+    except OSError as e:
+        log_message(logfile, f"Error reading {directory}: {e}", level="error")
+        return
+    for subdirectory in subdirectories:
+        yield from scan_directory(subdirectory, layer_path)
+
+def scan_files(location):
+    """
+    Yield (file_name, app_name, paths, tag, acls) for the relevant files of the apps, one app at a time.
+    paths lists the file in app/default and app/local (lowest precedence first), so each object is created once
+    with its effective settings. acls holds the ACL settings of the app from its .meta files.
+    """
+    with os.scandir(location) as apps:
+        for app in apps:
+            if not app.is_dir():
+                continue
+            app_files = {}
+            for layer in APP_LAYERS:
+                layer_path = os.path.join(app.path, layer)
+                if not os.path.isdir(layer_path):
+                    continue
+                for relative_directory, file_name, tag in scan_directory(layer_path, layer_path):
+                    paths = app_files.setdefault((relative_directory, file_name, tag), [])
+                    paths.append(os.path.normpath(os.path.join(layer_path, relative_directory, file_name)))
+            if not app_files:
+                continue
+            acls = load_app_acls(app.path)
+            for (relative_directory, file_name, tag), paths in app_files.items():
+                yield file_name, app.name, tuple(paths), tag, acls
+
+def parse_file(file_info):
+    """
+    Parse a discovered file and merge its default and local layers. XML files are not read here,
+    the local file replaces the default file and its content is read when the call is sent.
+    """
+    file_name, app_name, paths, tag, acls = file_info
+    parsed_data = None
+    try:
+        if file_name.endswith(".conf"):
+            layers = []
+            for path in paths:
+                layer_data, layer_tag = parse_files(path)
+                layers.append(layer_data)
+                tag = layer_tag or tag
+            parsed_data = merge_layers(layers)
+    except Exception as e:
+        log_message(logfile, f"Error parsing {paths[-1]}: {e}", level="error")
+        parsed_data = {}
+    return file_name, app_name, paths[-1], tag, parsed_data, acls
+
+# End of the discovery and parse stage
+PARSE_DONE = object()
+
+def iter_parsed_files(file_infos, workers):
+    """
+    Parse the discovered files in a pool of worker threads, ahead of the API calls.
+    Yields (file_name, app_name, file_path, tag, parsed_data, acls) in the order the files are parsed, so the first call
+    can be sent while the other files are still being scanned and parsed.
+    """
+    # Bounded, so parsed files do not pile up when the API calls are slower than the parsing
+    parsed = queue.Queue(maxsize=workers * 2)
+    # Set when the calls are no longer consumed (end of the run or an interrupt)
+    stopped = threading.Event()
+
+    def deliver(item):
+        while not stopped.is_set():
+            try:
+                parsed.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def discover():
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for file_info in file_infos:
+                    if stopped.is_set():
+                        break
+                    pool.submit(parse_file, file_info).add_done_callback(lambda future: deliver(future.result()))
+        except Exception as e:
+            log_message(logfile, f"Error scanning the apps: {e}", level="error")
+        finally:
+            deliver(PARSE_DONE)
+
+    threading.Thread(target=discover, name="parse-stage", daemon=True).start()
+    try:
+        while True:
+            item = parsed.get()
+            if item is PARSE_DONE:
+                return
+            yield item
+    finally:
+        stopped.set()
+
+def file_level(file_name, tag):
+    """Return the creation level of a discovered file, before it is parsed: XML files by their directory, .conf files by their name."""
+    if file_name == "props.conf":
+        # All props.conf object types have the same dependencies
+        return creation_level("props")
+    return creation_level(tag or tag_for_conf(file_name))
+
+def iter_first_level(file_infos, deferred):
+    """
+    Yield the discovered files of creation level 0 as they are found, and keep the files of higher levels in deferred.
+    Deferred files are kept unparsed and are parsed when their level starts, so the parsed objects of one level are in memory at a time.
+    """
+    for file_info in file_infos:
+        level = file_level(file_info[0], file_info[3])
+        if level == 0:
+            yield file_info
+        else:
+            deferred.setdefault(level, []).append(file_info)
+
+def run_levels(location, api_urls, token, args, max_api_calls, workers, plan=None):
+    """
+    Create the objects level by level (macros and transforms first, then eventtypes and props, ..., views and navs last),
+    so objects are created after the objects they refer to. All objects of a level are created concurrently.
+    With a plan, the calls are written to the plan with their level instead of being sent.
+    """
+    deferred = {}
+    levels = creation_levels()
+    for level in range(max(levels.values(), default=0) + 1):
+        tags = ", ".join(sorted(tag for tag, tag_level in levels.items() if tag_level == level))
+        if level == 0:
+            # The first level is created while the apps are still being scanned and parsed
+            file_infos = iter_first_level(scan_files(location), deferred)
+        else:
+            file_infos = deferred.pop(level, [])
+            if not file_infos:
+                continue
+        log_message(logfile, f"Creating level {level}: {tags}", level="info")
+        # The stanzas of the previous level are done, its schemas and values are not needed anymore
+        reset_stanza_pools()
+        files = iter_parsed_files(file_infos, workers)
+        if plan is not None:
+            plan.write_calls(iter_create_calls(files, api_urls, token, args), level)
+        else:
+            run_calls(iter_create_calls(files, api_urls, token, args), args, max_api_calls)
+
+def iter_create_calls(parsed_files, api_urls, token, args):
+    """
+    Yield the create call for every object in the parsed files, for every target API url.
+    The ACL of an object is only updated when its effective .meta settings differ from the ACL the create call gives it.
+    """
+    file_count = 0
+    acl_count = 0
+    for file_name, app_name, file_path, tag, parsed_data, acls in parsed_files:
+        file_count += 1
+        if file_name.endswith(".conf"):
+            # Objects of a .conf file are named after the file in the .meta files, e.g. [savedsearches/<name>]
+            conf_file = os.path.splitext(file_name)[0]
+            for stanza, params in parsed_data.items():
+                acl = acls.object_acl(conf_file, stanza)
+                for api_url_base in api_urls:
+                    call = prepare_create_call(api_url_base, token, args, file_name, stanza, params, app_name, tag, acl)
+                    if call:
+                        acl_count += 1 if acl else 0
+                        yield call
+        elif file_name.endswith(".xml"):
+            # Handle XML files (e.g., dashboards, panels, or navbars)
+            # The view, panel or nav is named after the file
+            view_name = os.path.splitext(file_name)[0]
+            acl = acls.object_acl(tag, view_name)
+            for api_url_base in api_urls:
+                call = prepare_create_call(api_url_base, token, args, file_name, view_name, {}, app_name, tag, acl)
+                if call:
+                    acl_count += 1 if acl else 0
+                    # The XML is read when the call is sent
+                    call["data_files"] = {"eai:data": file_path}
+                    yield call
+    log_message(logfile, f"Created the objects of {file_count} files, with {acl_count} ACL updates from the .meta files.", level="info")
 
 def rest_bulk_create(args):
     try:
         # Read configuration values
         api_url_base, location, token, max_api_calls = get_config()
+        api_urls = split_api_urls(api_url_base)
 
         # Record the start time
         start_time = datetime.datetime.now()
+        reset_metrics()
+        reset_stanza_pools()
         
         if args.dummy is False:
-            syntax_check(api_url_base)  
-
-        log_message(logfile, f"API url: {api_url_base}", level="info") 
-
-        delay_between_calls = 1.0 / max_api_calls  # 1 second divided by number of max API calls
-
-        # Collect files
-        files = collect_files(location)
-
-        log_message(logfile, f"Collected {len(files)} files from {location}.", level="info")
-
-        with ThreadPoolExecutor(max_workers=max_api_calls) as executor:
-            futures = []
-            for file_name, app_name, full_path, tag in files:
-                # Parse and process each file
-                file_path = os.path.join(location, app_name, "local", file_name)
-                if file_name.endswith(".conf"):
-                    parsed_data, tag = parse_files(file_path)
-                    for stanza, params in parsed_data.items():
-                        futures.append(
-                            executor.submit(
-                                build_create_url, api_url_base, token, args, file_name, stanza, params, app_name, tag
-                            )
-                        )
-                        time.sleep(delay_between_calls)
-                elif file_name.endswith(".xml"):
-                    # Handle XML files (e.g., dashboards, panels, or navbars)
-                    with open(full_path, 'r', encoding='utf-8') as f:
-                        xml_content = f.read()
-                    futures.append(
-                        executor.submit(
-                            build_create_url, api_url_base, token, args, file_name, "eai:data", xml_content, app_name, tag
-                        )
-                    )
-                    time.sleep(delay_between_calls)
-
-            for future in futures:
-                future.result()
+            for target_url in api_urls:
+                syntax_check(target_url)
+
+        log_message(logfile, f"API url: {', '.join(api_urls)}", level="info") 
+
+        # Plan mode: write the calls to a plan file, to be sent later with -apply
+        plan = PlanWriter(args.plan, "create", api_urls) if args.plan else None
+
+        # Share keep-alive connections and the rate limit between all API calls
+        setup_api_caller(max_api_calls)
+        configure_parse_cache(read_config_value("parse_cache", True), read_config_value("parse_cache_hash", False))
+
+        # Record every completed API call, so an interrupted run can be resumed with -resume
+        if args.dummy is False and plan is None:
+            open_journal(read_config_value("journal_path", "rest_api_journal.sqlite"))
+
+        # Scan and parse the files in worker threads, the calls are sent as soon as the first files are parsed
+        parse_workers = max(1, int(read_config_value("parse_workers", 4)))
+
+        # Send the calls with the thread pool or the asyncio engine, in the order of the object dependencies
+        try:
+            run_levels(location, api_urls, token, args, max_api_calls, parse_workers, plan)
+        except BaseException:
+            if plan is not None:
+                plan.abort()
+            raise
+        if plan is not None:
+            plan.close()
 
         runtime = (datetime.datetime.now() - start_time).seconds
+        if args.dummy is False and not args.async_engine and plan is None:
+            report_connection_stats()
+        report_target_stats()
+        report_cache_stats()
+        close_journal()
+        if args.dummy is False and plan is None:
+            write_run_report("create", read_config_value("metrics_directory", ""))
         print(f"Script completed in {runtime} seconds.")
         log_message(logfile, f"Script completed successfully in {runtime} seconds.", level="info")
 
@@ -2,118 +2,145 @@
 # USE THE SCRIPT AT YOUR OWN RISK
 # ALWAYS VERIFY RESULTS
 
-import os, re, sys
-import datetime, time
-from concurrent.futures import ThreadPoolExecutor
+import os, sys
+import datetime
 
 # import custom lib
 sys.path.append(os.path.join(os.path.dirname(__file__), "lib"))
 
 from script_logger import log_message
-from api_caller import build_enable_url, syntax_check
-from utils import get_config
+from api_caller import prepare_enable_call, fetch_saved_search_state, run_calls, syntax_check, setup_api_caller, report_connection_stats, report_target_stats
+from utils import get_config, read_config_value, split_api_urls
+from conf_parser import iter_stanzas
+from call_journal import open_journal, close_journal
+from parse_cache import cached_parse, configure_parse_cache, report_cache_stats
+from stanza_model import compact_stanzas, reset_stanza_pools
+from conf_merge import merge_layers, app_layer_paths, DEFAULT_STANZA
+from execution_plan import PlanWriter
+from run_metrics import reset_metrics, phase_timer, write_run_report
 
 __name__ = "rest_enable_savedsearches.py"
 __author__ = "Michel de Jong"
 logfile = "rest_api_runner"
 
 def parse_searches(savedsearches_path):
+    with phase_timer("parse"):
+        return compact_stanzas(cached_parse(savedsearches_path, "parse_searches", read_searches, {}))
+
+def read_searches(savedsearches_path):
+    """Parse a savedsearches.conf file. Raises an error when the file cannot be read or parsed."""
     params_dict = {}
-    current_section = None
 
-    try:
-        if os.path.exists(savedsearches_path):
-            with open(savedsearches_path, 'r', encoding='utf-8') as file:
-                for line in file:
-                    line = line.strip()
-                    if line.startswith('#'): # Skip comment lines
-                        continue
-                    stanza_match = re.match(r'^\[(.*)\]$', line)
-                    if stanza_match:
-                        current_section = stanza_match.group(1)
-                        params_dict[current_section] = {}
-                    elif '=' in line:
-                        if current_section:
-                            kv_pair = line.split('=', 1)
-                            if len(kv_pair) == 2:
-                                key, value = map(str.strip, kv_pair)
-                                params_dict[current_section][key] = value
-                                # Change key name to match Splunk REST API required values
-                                if "enableSched" in params_dict[current_section]:
-                                    params_dict[current_section]['is_scheduled'] = params_dict[current_section].pop('enableSched')
-    except Exception as e:
-        log_message(logfile, f"Error parsing {savedsearches_path}: {e}", level="error")
+    if os.path.exists(savedsearches_path):
+        for current_section, settings in iter_stanzas(savedsearches_path, global_stanza=DEFAULT_STANZA):
+            params = params_dict.setdefault(current_section, {})
+            params.update(settings)
+            # Change key name to match Splunk REST API required values
+            if "enableSched" in params:
+                params['is_scheduled'] = params.pop('enableSched')
     return params_dict
 
+def iter_enable_decisions(location, app_name):
+    """Yield (stanza name, enabled) once for every saved search of an app, from the effective default + local settings."""
+    layers = [parse_searches(path) for path in app_layer_paths(os.path.join(location, app_name), "savedsearches.conf")]
+    for stanza_name, savedsearch_params in merge_layers(layers).items():
+        if not savedsearch_params:
+            log_message(logfile, f"Skipping saved search '{stanza_name}' in app '{app_name}' as no parameters found.", level="info")
+            continue
+
+        # local overrides default, and the [default] stanza applies when the search does not set 'disabled'
+        disabled_value = savedsearch_params.get("disabled", None)
+        if disabled_value is not None:
+            disabled_value = disabled_value.lower()
+
+        if disabled_value == "0" or disabled_value == "false" or disabled_value is None:
+            yield stanza_name, True
+        if disabled_value == "1" or disabled_value == "true":
+            yield stanza_name, False
+
+def iter_enable_calls(location, api_urls, token, args):
+    """Yield the enable/disable call for every saved search in the apps directory, for every target API url."""
+    if not args.enable:
+        return
+
+    skipped = 0
+    for app_name in os.listdir(os.path.join(location)):
+        decisions = iter_enable_decisions(location, app_name)
+        current_state = {}
+
+        # Differential mode: compare the final state of each search with the state on each target
+        if args.diff and not args.dummy:
+            decisions = list(decisions)
+            if decisions:
+                with phase_timer("state_fetch"):
+                    for api_url in api_urls:
+                        current_state[api_url] = fetch_saved_search_state(api_url, token, app_name, read_config_value("state_page_size", 0))
+
+        # The app is parsed once, the calls for all targets are interleaved so the targets run concurrently
+        for stanza_name, enabled in decisions:
+            for api_url in api_urls:
+                target_state = current_state.get(api_url)
+                if target_state is not None and target_state.get(stanza_name) is (not enabled):
+                    skipped += 1
+                    if args.debug:
+                        log_message(logfile, f"Skipping saved search '{stanza_name}' in app '{app_name}' on {api_url} as it is already {'enabled' if enabled else 'disabled'}.", level="debug")
+                    continue
+
+                yield prepare_enable_call(api_url, token, args, app_name, stanza_name, enabled)
+
+    if args.diff and not args.dummy:
+        print(f"Skipped {skipped} saved searches that are already in the right state.")
+        log_message(logfile, f"Skipped {skipped} saved searches that are already in the right state.", level="info")
+
 def rest_bulk_update_savedsearches(args):
     try:
         api_url, location, token, max_api_calls = get_config()
+        api_urls = split_api_urls(api_url)
         # Record the start time
         start_time = datetime.datetime.now()
+        reset_metrics()
+        reset_stanza_pools()
         
         if args.dummy is False:
-            syntax_check(api_url)  
-
-        log_message(logfile, f"API url: {api_url}", level="info") 
-
-        delay_between_calls = 1.0 / max_api_calls  # 1 second divided by number of max API calls
-
-        # Create a thread pool for making API calls
-        with ThreadPoolExecutor(max_workers=max_api_calls) as executor:
-            futures = []
-            for app_name in os.listdir(os.path.join(location)):
-                savedsearches_default_path = os.path.join(location, app_name, "default", "savedsearches.conf")
-                savedsearches_data = parse_searches(savedsearches_default_path)
-                # Dictionary to store 'disabled' values for each stanza from the default
-                default_disabled = {}
-
-                for stanza_name, savedsearch_params in savedsearches_data.items():
-                    if not savedsearch_params:
-                        log_message(logfile, f"Skipping default saved search '{stanza_name}' in app '{app_name}' as no parameters found.", level="info")
-                        continue
-                    
-                    # Store the 'disabled' value from default configuration
-                    disabled_value = savedsearch_params.get("disabled", None)
-                    if disabled_value is not None:
-                        disabled_value = disabled_value.lower()
-                    default_disabled[stanza_name] = disabled_value
-
-                    if args.enable:
-                        if disabled_value == "0" or disabled_value == "false" or disabled_value is None:
-                            futures.append(executor.submit(time.sleep, delay_between_calls))
-                            futures.append(executor.submit(build_enable_url, api_url, token, args, app_name, stanza_name, True))
-                        if disabled_value == "1" or disabled_value == "true":
-                            futures.append(executor.submit(time.sleep, delay_between_calls))
-                            futures.append(executor.submit(build_enable_url, api_url, token, args, app_name, stanza_name, False))
-
-                savedsearches_local_path = os.path.join(location, app_name, "local", "savedsearches.conf")
-                savedsearches_data = parse_searches(savedsearches_local_path)
-                for stanza_name, savedsearch_params in savedsearches_data.items():
-                    if not savedsearch_params:
-                        log_message(logfile, f"Skipping local saved search '{stanza_name}' in app '{app_name}' as no parameters found.", level="info")
-                        continue
-                    
-                    if args.enable:
-                        # Check if the stanza exists in default configuration
-                        disabled_value = savedsearch_params.get("disabled", None)
-                        if disabled_value is None and stanza_name in default_disabled:
-                            disabled_value = default_disabled[stanza_name].lower()
-                        
-                        if disabled_value == "0" or disabled_value == "false" or disabled_value is None:
-                            futures.append(executor.submit(time.sleep, delay_between_calls))
-                            futures.append(executor.submit(build_enable_url, api_url, token, args, app_name, stanza_name, True))
-                        if disabled_value == "1" or disabled_value == "true":
-                            futures.append(executor.submit(time.sleep, delay_between_calls))
-                            futures.append(executor.submit(build_enable_url, api_url, token, args, app_name, stanza_name, False))
-
-            # Wait for all futures to complete
-            for future in futures:
-                future.result()
+            for target_url in api_urls:
+                syntax_check(target_url)
+
+        log_message(logfile, f"API url: {', '.join(api_urls)}", level="info") 
+
+        # Plan mode: write the calls to a plan file, to be sent later with -apply
+        plan = PlanWriter(args.plan, "enable", api_urls) if args.plan else None
+
+        # Share keep-alive connections and the rate limit between all API calls
+        setup_api_caller(max_api_calls)
+        configure_parse_cache(read_config_value("parse_cache", True), read_config_value("parse_cache_hash", False))
+
+        # Record every completed API call, so an interrupted run can be resumed with -resume
+        if args.dummy is False and plan is None:
+            open_journal(read_config_value("journal_path", "rest_api_journal.sqlite"))
+
+        if plan is not None:
+            try:
+                plan.write_calls(iter_enable_calls(location, api_urls, token, args))
+            except BaseException:
+                plan.abort()
+                raise
+            plan.close()
+        else:
+            # Send the calls with the thread pool or the asyncio engine
+            run_calls(iter_enable_calls(location, api_urls, token, args), args, max_api_calls)
 
         # Calculate the runtime
         end_time = datetime.datetime.now()
         runtime = (end_time - start_time).seconds
 
+        if args.dummy is False and not args.async_engine and plan is None:
+            report_connection_stats()
+        report_target_stats()
+        report_cache_stats()
+        close_journal()
+        if args.dummy is False and plan is None:
+            write_run_report("enable", read_config_value("metrics_directory", ""))
+
         # Display the runtime notification
         print(f"Script completed in {runtime} seconds.")
         print(f"Logfiles are created in the working directory of the script")
@@ -0,0 +1,211 @@
+### DISCLAIMER
+# USE THE SCRIPT AT YOUR OWN RISK
+# ALWAYS VERIFY RESULTS
+
+import os, sys
+import re
+import json
+import time
+import datetime
+import threading
+import contextlib
+import urllib.parse
+
+# import custom lib
+sys.path.append(os.path.join(os.path.dirname(__file__), "lib"))
+
+from script_logger import log_message, create_log_directory
+from object_registry import load_registry
+from utils import target_of
+
+__name__ = "run_metrics.py"
+__author__ = "Michel de Jong"
+logfile = "rest_api_runner"
+
+# Upper bounds in seconds of the latency histogram buckets of the Prometheus textfile
+HISTOGRAM_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# servicesNS/<owner>/<app>/<endpoint>[/<name>][/acl]
+SERVICES_PATTERN = re.compile(r'^/servicesNS/[^/]+/[^/]+/(?P<rest>.*?)/?$')
+
+# Call durations and status codes per (target, endpoint), and the completed calls per second of the run
+durations = {}
+status_codes = {}
+calls_per_second = {}
+phases = {}
+run_start = time.monotonic()
+run_started_at = datetime.datetime.now()
+metrics_lock = threading.Lock()
+
+# Endpoint label per URL path prefix, longest endpoint first
+endpoint_labels = None
+
+def reset_metrics():
+    """Start the metrics of a new run."""
+    global run_start, run_started_at
+    with metrics_lock:
+        durations.clear()
+        status_codes.clear()
+        calls_per_second.clear()
+        phases.clear()
+        run_start = time.monotonic()
+        run_started_at = datetime.datetime.now()
+
+def endpoint_label(api_url):
+    """Return the REST endpoint of an API url (e.g. configs/conf-savedsearches or data/ui/views/acl)."""
+    global endpoint_labels
+    if endpoint_labels is None:
+        endpoint_labels = sorted({object_type.endpoint for object_type in load_registry().values()}, key=len, reverse=True)
+
+    path = urllib.parse.urlparse(api_url).path
+    match = SERVICES_PATTERN.match(path)
+    if not match:
+        return path or "unknown"
+    rest = match.group("rest")
+    for endpoint in endpoint_labels:
+        if rest == endpoint or rest.startswith(endpoint + "/"):
+            return f"{endpoint}/acl" if rest.endswith("/acl") else endpoint
+    return rest
+
+def record_call(api_url, status_code, duration):
+    """Record an API call. status_code is None and duration None when no response was received."""
+    key = (target_of(api_url), endpoint_label(api_url))
+    status = str(status_code) if status_code is not None else "error"
+    second = int(time.monotonic() - run_start)
+    with metrics_lock:
+        if duration is not None:
+            durations.setdefault(key, []).append(duration)
+        codes = status_codes.setdefault(key, {})
+        codes[status] = codes.get(status, 0) + 1
+        calls_per_second[second] = calls_per_second.get(second, 0) + 1
+
+def add_phase_time(name, seconds):
+    with metrics_lock:
+        phases[name] = phases.get(name, 0.0) + seconds
+
+@contextlib.contextmanager
+def phase_timer(name):
+    """Add the time spent in the block to a phase of the run (e.g. parse)."""
+    st = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_phase_time(name, time.perf_counter() - st)
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def latency_summary(values):
+    ordered = sorted(values)
+    return {
+        "count": len(ordered),
+        "p50": percentile(ordered, 0.50),
+        "p95": percentile(ordered, 0.95),
+        "p99": percentile(ordered, 0.99),
+        "max": ordered[-1] if ordered else 0.0,
+        "sum": sum(ordered),
+    }
+
+def all_durations():
+    with metrics_lock:
+        return [duration for values in durations.values() for duration in values]
+
+def build_report(run_name):
+    """Build the run report as a dictionary."""
+    elapsed = time.monotonic() - run_start
+    with metrics_lock:
+        targets = {}
+        for (target, endpoint), codes in sorted(status_codes.items()):
+            target_report = targets.setdefault(target, {"calls": 0, "latency": [], "endpoints": {}})
+            target_report["calls"] += sum(codes.values())
+            target_report["latency"].extend(durations.get((target, endpoint), []))
+            target_report["endpoints"][endpoint] = {"latency": latency_summary(durations.get((target, endpoint), [])), "status_codes": dict(codes)}
+        for target_report in targets.values():
+            target_report["latency"] = latency_summary(target_report["latency"])
+        timeline = [{"second": second, "calls": calls_per_second.get(second, 0)} for second in range(int(elapsed) + 1)]
+        total_calls = sum(calls_per_second.values())
+        phase_times = dict(phases)
+    return {
+        "run": run_name,
+        "started_at": run_started_at.isoformat(),
+        "elapsed_seconds": elapsed,
+        "total_calls": total_calls,
+        "calls_per_second": total_calls / elapsed if elapsed > 0 else 0.0,
+        "latency": latency_summary(all_durations()),
+        "phases": phase_times,
+        "targets": targets,
+        "throughput": timeline,
+    }
+
+def prometheus_lines(report):
+    """Render the run report in the Prometheus text exposition format."""
+    run = report["run"]
+    lines = [
+        "# HELP splunkcloud_tools_api_call_duration_seconds Response time of the API calls.",
+        "# TYPE splunkcloud_tools_api_call_duration_seconds histogram",
+    ]
+    with metrics_lock:
+        endpoint_durations = {key: sorted(values) for key, values in durations.items()}
+    for (target, endpoint), values in sorted(endpoint_durations.items()):
+        labels = f'run="{run}",target="{target}",endpoint="{endpoint}"'
+        index = 0
+        for bound in HISTOGRAM_BUCKETS:
+            while index < len(values) and values[index] <= bound:
+                index += 1
+            lines.append(f'splunkcloud_tools_api_call_duration_seconds_bucket{{{labels},le="{bound}"}} {index}')
+        lines.append(f'splunkcloud_tools_api_call_duration_seconds_bucket{{{labels},le="+Inf"}} {len(values)}')
+        lines.append(f'splunkcloud_tools_api_call_duration_seconds_sum{{{labels}}} {sum(values)}')
+        lines.append(f'splunkcloud_tools_api_call_duration_seconds_count{{{labels}}} {len(values)}')
+
+    lines.append("# HELP splunkcloud_tools_api_calls_total API calls by target, endpoint and status code.")
+    lines.append("# TYPE splunkcloud_tools_api_calls_total counter")
+    for target, target_report in report["targets"].items():
+        for endpoint, data in target_report["endpoints"].items():
+            for status, count in sorted(data["status_codes"].items()):
+                lines.append(f'splunkcloud_tools_api_calls_total{{run="{run}",target="{target}",endpoint="{endpoint}",status="{status}"}} {count}')
+
+    lines.append("# HELP splunkcloud_tools_phase_seconds Time spent in a phase of the run.")
+    lines.append("# TYPE splunkcloud_tools_phase_seconds gauge")
+    for phase, seconds in sorted(report["phases"].items()):
+        lines.append(f'splunkcloud_tools_phase_seconds{{run="{run}",phase="{phase}"}} {seconds}')
+
+    lines.append("# HELP splunkcloud_tools_run_seconds Duration of the run.")
+    lines.append("# TYPE splunkcloud_tools_run_seconds gauge")
+    lines.append(f'splunkcloud_tools_run_seconds{{run="{run}"}} {report["elapsed_seconds"]}')
+    lines.append("# HELP splunkcloud_tools_run_calls_per_second Average API calls per second of the run.")
+    lines.append("# TYPE splunkcloud_tools_run_calls_per_second gauge")
+    lines.append(f'splunkcloud_tools_run_calls_per_second{{run="{run}"}} {report["calls_per_second"]}')
+    return lines
+
+def write_atomic(path, content):
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as file:
+        file.write(content)
+    os.replace(temp_path, path)
+
+def write_run_report(run_name, directory=""):
+    """
+    Write the JSON run report and the Prometheus textfile of the run.
+    The files are written to the log directory, or to directory (e.g. the textfile collector directory of node_exporter).
+    """
+    try:
+        report = build_report(run_name)
+        directory = directory or create_log_directory(logfile)
+        os.makedirs(directory, exist_ok=True)
+
+        report_path = os.path.join(directory, f"run_report_{run_name}_{run_started_at.strftime('%Y%m%d_%H%M%S')}.json")
+        write_atomic(report_path, json.dumps(report, indent=2))
+        # The textfile is overwritten by every run, Prometheus only reads the latest values
+        textfile_path = os.path.join(directory, f"splunkcloud_tools_{run_name}.prom")
+        write_atomic(textfile_path, "\n".join(prometheus_lines(report)) + "\n")
+
+        latency = report["latency"]
+        print(f"Latency - p50: {latency['p50']:.3f}s | p95: {latency['p95']:.3f}s | p99: {latency['p99']:.3f}s | Max: {latency['max']:.3f}s")
+        print(f"Run report: {report_path}")
+        log_message(logfile, f"Run report written to {report_path} and {textfile_path}", level="info")
+        return report
+    except Exception as e:
+        log_message(logfile, f"Error writing the run report: {e}", level="error")
+        return None
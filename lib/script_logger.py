@@ -1,24 +1,44 @@
 import os
+import json
+import queue
+import atexit
 import datetime
+import threading
 
-def log_message(name, message, level):
-    log_directory = create_log_directory(name)
-    log_file = os.path.join(log_directory, f"{level}.log")
+# Log lines are queued by the callers and written in batches by a background thread
+log_queue = queue.Queue()
+writer_thread = None
+writer_pid = None
+writer_lock = threading.Lock()
+
+# Write an extra log.jsonl with one JSON object per log line
+jsonl_enabled = False
+
+# Cache of created log directories, per name and date
+log_directories = {}
+
+def configure_logging(jsonl=False):
+    global jsonl_enabled
+    jsonl_enabled = jsonl
 
-    with open(log_file, "a") as f:
-        now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
-        f.write(f"[{now}] [{level.upper()}] {message}\n")
+def log_message(name, message, level):
+    start_writer()
+    log_queue.put((datetime.datetime.now(), name, message, level))
 
-def create_log_directory(name):
+def create_log_directory(name, now=None):
     try:     
-        date = datetime.datetime.now().strftime("%Y%m%d")
-        name = name.replace(".py", "")
-        directory_name = os.path.join("logs", f"{name}_{date}")
+        date = (now or datetime.datetime.now()).strftime("%Y%m%d")
+        directory_name = log_directories.get((name, date))
+        if directory_name:
+            return directory_name
+
+        directory_name = os.path.join("logs", f"{name.replace('.py', '')}_{date}")
         
         # Attempt to create the directory, handling any potential errors
         if not os.path.exists(directory_name):
             os.makedirs(directory_name)
         
+        log_directories[(name, date)] = directory_name
         return directory_name
 
     except OSError as e:
@@ -29,3 +49,85 @@ def create_log_directory(name):
         # Handle other unexpected errors
         print(f"An unexpected error occurred: {e}")
         return None
+
+def start_writer():
+    global log_queue, writer_thread, writer_pid
+    if writer_thread is not None and writer_pid == os.getpid():
+        return
+    with writer_lock:
+        if writer_thread is not None and writer_pid == os.getpid():
+            return
+        if writer_pid is not None and writer_pid != os.getpid():
+            # Forked child process: the writer thread of the parent does not exist here
+            log_queue = queue.Queue()
+            log_directories.clear()
+        writer_pid = os.getpid()
+        writer_thread = threading.Thread(target=write_logs, args=(log_queue,), name="log_writer", daemon=True)
+        writer_thread.start()
+
+def write_logs(messages):
+    handles = {}
+    try:
+        while True:
+            batch = [messages.get()]
+            # Take whatever else is waiting, to write it in one go
+            while len(batch) < 1000:
+                try:
+                    batch.append(messages.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = False
+            flushed = []
+            for item in batch:
+                if isinstance(item, threading.Event):
+                    flushed.append(item)
+                    continue
+                if item is None:
+                    stop = True
+                    continue
+                write_line(handles, *item)
+
+            for handle in handles.values():
+                handle.flush()
+            for event in flushed:
+                event.set()
+            if stop:
+                return
+    finally:
+        for handle in handles.values():
+            handle.close()
+
+def write_line(handles, now, name, message, level):
+    log_directory = create_log_directory(name, now)
+    if log_directory is None:
+        return
+    try:
+        log_file = os.path.join(log_directory, f"{level}.log")
+        if log_file not in handles:
+            handles[log_file] = open(log_file, "a")
+        handles[log_file].write(f"[{now.strftime('%Y-%m-%d %H:%M:%S.%f')}] [{level.upper()}] {message}\n")
+
+        if jsonl_enabled:
+            jsonl_file = os.path.join(log_directory, "log.jsonl")
+            if jsonl_file not in handles:
+                handles[jsonl_file] = open(jsonl_file, "a")
+            handles[jsonl_file].write(json.dumps({"time": now.isoformat(), "level": level, "logger": name, "message": str(message)}) + "\n")
+    except Exception as e:
+        print(f"Error writing log message: {e}")
+
+def flush_logs(timeout=10):
+    """Block until all queued log lines are written."""
+    if writer_thread is None or writer_pid != os.getpid() or not writer_thread.is_alive():
+        return
+    event = threading.Event()
+    log_queue.put(event)
+    event.wait(timeout)
+
+def stop_logging():
+    flush_logs()
+    if writer_thread is not None and writer_pid == os.getpid() and writer_thread.is_alive():
+        log_queue.put(None)
+        writer_thread.join(10)
+
+atexit.register(stop_logging)
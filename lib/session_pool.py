@@ -0,0 +1,74 @@
+### DISCLAIMER
+# USE THE SCRIPT AT YOUR OWN RISK
+# ALWAYS VERIFY RESULTS
+
+import os, sys
+import threading
+import urllib.parse, urllib3
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+import requests
+from requests.adapters import HTTPAdapter
+
+# import custom lib
+sys.path.append(os.path.join(os.path.dirname(__file__), "lib"))
+
+from script_logger import log_message
+
+__name__ = "session_pool.py"
+__author__ = "Michel de Jong"
+logfile = "rest_api_runner"
+
+# One keep-alive session per target host, shared by all worker threads
+sessions = {}
+pool_size = 10
+
+# Lock for creating sessions and reading the pool counters
+session_lock = threading.Lock()
+
+def configure_session_pool(max_api_calls):
+    """Size the connection pools to the number of parallel API calls."""
+    global pool_size
+    with session_lock:
+        pool_size = max(1, int(max_api_calls))
+
+def get_session(api_url):
+    """Return the pooled keep-alive session for the host of the given API url."""
+    host = urllib.parse.urlparse(api_url).netloc
+    session = sessions.get(host)
+    if session is None:
+        with session_lock:
+            session = sessions.get(host)
+            if session is None:
+                session = requests.Session()
+                session.verify = False
+                # Block instead of opening throw-away connections when all pooled connections are busy
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True, max_retries=0)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                sessions[host] = session
+                log_message(logfile, f"Opened connection pool for {host} with {pool_size} connections", level="info")
+    return session
+
+def connection_stats():
+    """Return the number of connections opened and the number of requests that reused a connection."""
+    opened = 0
+    requests_sent = 0
+    with session_lock:
+        for session in sessions.values():
+            # The same adapter is mounted for http and https
+            for adapter in set(session.adapters.values()):
+                manager = adapter.poolmanager
+                for key in list(manager.pools.keys()):
+                    pool = manager.pools.get(key)
+                    if pool is None:
+                        continue
+                    opened += pool.num_connections
+                    requests_sent += pool.num_requests
+    return opened, max(0, requests_sent - opened)
+
+def close_sessions():
+    """Close all pooled sessions and their connections."""
+    with session_lock:
+        for session in sessions.values():
+            session.close()
+        sessions.clear()
@@ -0,0 +1,93 @@
+### DISCLAIMER
+# USE THE SCRIPT AT YOUR OWN RISK
+# ALWAYS VERIFY RESULTS
+
+import sys
+from collections.abc import Mapping
+
+__name__ = "stanza_model.py"
+__author__ = "Michel de Jong"
+
+# Values up to this length are shared between stanzas (e.g. "1", "-24h@h", "now"), longer values (searches) are kept as is
+MAX_SHARED_VALUE = 64
+
+# Upper bounds of the pools, further schemas and values are not shared
+MAX_SCHEMAS = 10000
+MAX_SHARED_VALUES = 100000
+
+# Schemas per tuple of keys and shared values of the parsed files of a run, emptied with reset_stanza_pools
+schemas = {}
+shared_values = {}
+
+class StanzaSchema:
+    """The keys of a stanza, shared by all stanzas with the same keys in the same order."""
+    __slots__ = ("keys", "index")
+
+    def __init__(self, keys):
+        self.keys = keys
+        self.index = {key: position for position, key in enumerate(keys)}
+
+def reset_stanza_pools():
+    """Empty the shared schemas and values. Stanzas created before keep theirs."""
+    schemas.clear()
+    shared_values.clear()
+
+def get_schema(keys):
+    schema = schemas.get(keys)
+    if schema is None:
+        schema = StanzaSchema(keys)
+        if len(schemas) < MAX_SCHEMAS:
+            schema = schemas.setdefault(keys, schema)
+    return schema
+
+def share_value(value):
+    if isinstance(value, str) and len(value) <= MAX_SHARED_VALUE:
+        shared = shared_values.get(value)
+        if shared is not None:
+            return shared
+        if len(shared_values) < MAX_SHARED_VALUES:
+            return shared_values.setdefault(value, value)
+    return value
+
+class Stanza(Mapping):
+    """
+    Read-only settings of a stanza: a shared schema with the interned keys and a tuple with the values.
+    Behaves like a dictionary for reading ({**stanza}, stanza.get(key), stanza.items()).
+    """
+    __slots__ = ("schema", "values")
+
+    def __init__(self, settings):
+        self.schema = get_schema(tuple(sys.intern(key) for key in settings))
+        self.values = tuple(share_value(value) for value in settings.values())
+
+    def __getitem__(self, key):
+        return self.values[self.schema.index[key]]
+
+    def get(self, key, default=None):
+        position = self.schema.index.get(key)
+        return default if position is None else self.values[position]
+
+    def keys(self):
+        return self.schema.keys
+
+    def items(self):
+        return list(zip(self.schema.keys, self.values))
+
+    def __contains__(self, key):
+        return key in self.schema.index
+
+    def __iter__(self):
+        return iter(self.schema.keys)
+
+    def __len__(self):
+        return len(self.values)
+
+    def __repr__(self):
+        return f"Stanza({dict(self)!r})"
+
+    def to_dict(self):
+        return dict(zip(self.schema.keys, self.values))
+
+def compact_stanzas(params_dict):
+    """Convert a dictionary of stanza name -> settings dictionary to compact stanzas."""
+    return {name: Stanza(settings) for name, settings in params_dict.items()}
@@ -5,6 +5,7 @@
 import os, sys
 import getpass
 import json
+import urllib.parse
 
 # import custom lib
 sys.path.append(os.path.join(os.path.dirname(__file__), "lib"))
@@ -54,12 +55,27 @@ def read_config_params():
         print(f"Unexpected error: {e}. Using default values.")
         return 10, "", "", ""
 
+def read_config_value(key, default):
+    """Read an optional tuning parameter from configs.json."""
+    try:
+        config_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "../configs/configs.json")
+        with open(config_path, 'r') as file:
+            return json.load(file).get(key, default)
+    except Exception as e:
+        log_message(logfile, f"Error reading '{key}' from configs.json: {e}. Using default value {default}.", level="error")
+        return default
+
+# endpoint_mapping.json is loaded once per run
+endpoint_mapping_cache = None
+
 def endpoint_mapping():
     """Load the endpoint_mapping.json file."""
+    global endpoint_mapping_cache
+    if endpoint_mapping_cache is not None:
+        return endpoint_mapping_cache
     try:
         # Construct the path to endpoint_mapping.json
-        json_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "../configs/endpoint_configs.json")
-
+        json_path = os.path.join(os.path.dirname(os.path.realpath(__file__)), "../configs/endpoint_mapping.json")
 
         # Check if the file exists
         if not os.path.exists(json_path):
@@ -68,14 +84,46 @@ def endpoint_mapping():
 
         # Load and parse the JSON file
         with open(json_path, "r", encoding="utf-8") as json_file:
-            endpoint_mapping = json.load(json_file)
+            endpoint_mapping_cache = json.load(json_file)
             log_message(logfile, "Successfully loaded endpoint_mapping.json", level="info")
-            return endpoint_mapping
+            return endpoint_mapping_cache
 
     except Exception as e:
         log_message(logfile, f"Error loading endpoint_mapping.json: {e}", level="error")
         return None
 
+def split_api_urls(api_url):
+    """Return the list of target API urls from a list or a comma separated api_url."""
+    if isinstance(api_url, (list, tuple)):
+        urls = api_url
+    else:
+        urls = str(api_url or "").split(",")
+    targets = []
+    for url in urls:
+        url = str(url).strip().rstrip("/")
+        if url and url not in targets:
+            targets.append(url)
+    return targets
+
+def target_of(api_url):
+    """Return the scheme and host of an API url, which identifies the target stack or search head."""
+    parsed = urllib.parse.urlparse(api_url)
+    return f"{parsed.scheme}://{parsed.netloc}"
+
+def call_data(call):
+    """
+    Return the payload of a prepared call. Values listed in 'data_files' (e.g. the XML of a view) are read from disk
+    only now, so queued calls do not keep file contents in memory.
+    """
+    data_files = call.get("data_files")
+    if not data_files:
+        return call["data"]
+    data = dict(call["data"])
+    for key, path in data_files.items():
+        with open(path, 'r', encoding='utf-8') as file:
+            data[key] = file.read()
+    return data
+
 def ask_for_input(value, value_name, is_password=False):
     if value:
         return value
@@ -92,7 +140,7 @@ def get_config():
         config_path, max_api_calls, api_url, location, token = read_config_params()
         
         # Ask for user input only if not pre-configured
-        print(f"\nAPI URL: {api_url if api_url else 'Not provided by configs.json'}")
+        print(f"\nAPI URL: {', '.join(split_api_urls(api_url)) if api_url else 'Not provided by configs.json'}")
         print(f"App Location: {location if location else 'Not provided by configs.json'}")
         print(f"Token: {'******' if token else 'Not provided by configs.json'}")
 
@@ -102,13 +150,13 @@ def get_config():
             if correct != 'y':
                 # If the user says no, re-ask for the incorrect parameters only
                 if api_url == "":
-                    api_url = ask_for_input("", "API url (https://shc1.stackname.splunkcloud.com:8089, https://(es-)stackname.splunkcloud.com:8089, http(s)://anyhost:8089)")
+                    api_url = ask_for_input("", "API url (https://shc1.stackname.splunkcloud.com:8089, https://(es-)stackname.splunkcloud.com:8089, http(s)://anyhost:8089, comma separated for multiple targets)")
                 if location == "":
                     location = ask_for_input("", "apps location")
                 if token == "":
                     token = ask_for_input("", "authentication token", is_password=True)
         else:
-            api_url = ask_for_input(api_url, "API url (https://shc1.stackname.splunkcloud.com:8089, https://(es-)stackname.splunkcloud.com:8089, http(s)://anyhost:8089)")
+            api_url = ask_for_input(api_url, "API url (https://shc1.stackname.splunkcloud.com:8089, https://(es-)stackname.splunkcloud.com:8089, http(s)://anyhost:8089, comma separated for multiple targets)")
             location = ask_for_input(location, "apps location")
             token = ask_for_input(token, "authentication token", is_password=True)
 
@@ -9,16 +9,27 @@ import argparse
 # import custom lib
 sys.path.append(os.path.join(os.path.dirname(__file__), "lib"))
 
+# The scripts are imported once selected, so the startup does not load requests, urllib3 and the thread pools
 from module_checker import check_modules
-from disabling_savedsearches import disabling_savedsearches
-from rest_update_savedsearches import rest_bulk_update_savedsearches
-from rest_bulk_create import rest_bulk_create
+from script_logger import configure_logging
+from utils import read_config_value
 
 __name__ = "splunkcloud_tools.py"
 __author__ = "Michel de Jong"
 
 def splunkcloud_tools(args):
     try:
+        # Apply a plan without the script selection, the plan holds all calls
+        if args.apply:
+            required_modules = ['urllib.parse', 'requests', 'datetime', 'concurrent.futures', 'threading', 'sqlite3']
+            if args.async_engine:
+                required_modules += ['asyncio', 'aiohttp']
+            check_modules(required_modules)
+            from execution_plan import apply_plan
+            apply_plan(args)
+            print("Finished. Exiting the script.")
+            exit(0)
+
         # Select which script
         selection = input("Select which script you want to use: \n 1) Disable Savedsearches (pre-deployment) \n 2) Enable scheduled searches (post-deployment) \n 3) Create all Savedsearches \n")
         
@@ -32,8 +43,11 @@ def splunkcloud_tools(args):
                 else:
                     print("Invalid input. Exiting the script.")
                     exit(0)
-            required_modules = ['shutil', 'datetime', 'datetime']
+            required_modules = ['shutil', 'datetime', 'hashlib']
+            if args.parallel:
+                required_modules += ['concurrent.futures']
             check_modules(required_modules)
+            from disabling_savedsearches import disabling_savedsearches
             disabling_savedsearches(args)
             print("Finished. Exiting the script")
             exit(0)
@@ -48,7 +62,7 @@ def splunkcloud_tools(args):
                 else:
                     print("Invalid input. Exiting the script.")
                     exit(0)
-            if args.dummy is False:
+            if args.dummy is False and not args.plan:
                 dummy = input("Enable dummy mode? (bypasses the actual API calls) (y/n) \n")
                 if dummy.lower() == "y":
                     args.dummy = True
@@ -58,16 +72,20 @@ def splunkcloud_tools(args):
                     print("Invalid input. Exiting the script.")
                     exit(0)
             
-            required_modules = ['re', 'getpass', 'urllib.parse', 'requests', 'datetime', 'time', 'configparser', 'collections', 'concurrent.futures', 'threading']
+            required_modules = ['re', 'getpass', 'urllib.parse', 'requests', 'datetime', 'time', 'collections', 'concurrent.futures', 'threading', 'sqlite3']
+            if args.async_engine:
+                required_modules += ['asyncio', 'aiohttp']
             check_modules(required_modules)
 
             if selection == "2":
                 args.enable = True
+                from rest_update_savedsearches import rest_bulk_update_savedsearches
                 rest_bulk_update_savedsearches(args)
                 print("Finished. Exiting the script.")
                 exit(0)
             if selection == "3":
                 args.create = True
+                from rest_bulk_create import rest_bulk_create
                 rest_bulk_create(args)
                 print("Finished. Exiting the script.")
                 exit(0)
@@ -76,6 +94,8 @@ def splunkcloud_tools(args):
             exit(0)
 
     except KeyboardInterrupt:
+        if args.enable or args.create or args.apply:
+            print("\nInterrupted. Completed API calls are recorded in the journal, run again with -resume to skip them.")
         exit(0)
     except Exception as e:
         print(f"An error occurred: {e}")
@@ -84,8 +104,19 @@ if __name__ == "splunkcloud_tools.py":
     parser = argparse.ArgumentParser(description="Splunk Cloud tools to disable scheduled searches in a given directory with apps (pre-deployment), enable scheduled searches on specific endpoints based on a given directory with apps (post-search-deployment) and create savedsearches (post-app-deployment). Please refer the README.md for more information.")
     parser.add_argument("-debug", action="store_true", help="Enable debug mode, create an extra logfile with all debug logs")
     parser.add_argument("-dummy", action="store_true", help="Run in dummy mode, bypasses the actual API calls when running the enable scheduled searches script")
+    parser.add_argument("-async", dest="async_engine", action="store_true", help="Use the asyncio engine (requires aiohttp) to keep many API calls in flight on a single thread when enabling or creating searches")
+    parser.add_argument("-diff", action="store_true", help="Only enable/disable saved searches whose state on the stack differs from the apps directory (fetches the current state once per app)")
+    parser.add_argument("-link", action="store_true", help="Disable Savedsearches only: stage the apps with reflinks/hardlinks instead of a full copy, only savedsearches.conf files are copied")
+    parser.add_argument("-parallel", action="store_true", help="Disable Savedsearches only: rewrite the savedsearches.conf files of the apps in parallel processes (needs the fork start method, e.g. Linux or macOS; elsewhere the apps are processed one by one)")
+    parser.add_argument("-incremental", action="store_true", help="Disable Savedsearches only: keep a manifest of source and output hashes and only re-process the apps that changed since the last run")
+    parser.add_argument("-resume", action="store_true", help="Enable/create only: skip the API calls that already completed successfully with the same payload in an earlier run (see journal_path in configs.json)")
+    parser.add_argument("-plan", metavar="PLAN_FILE", help="Enable/create only: write the API calls (method, URL, payload, dependency level, payload hash) to a JSONL plan file instead of sending them")
+    parser.add_argument("-apply", metavar="PLAN_FILE", help="Send the API calls of a plan file created with -plan, without scanning and parsing the apps")
     args = parser.parse_args()
     args.create = False
     args.enable = False
 
+    # Optional structured log output (logs/<name>_<date>/log.jsonl)
+    configure_logging(jsonl=read_config_value("log_jsonl", False))
+
     splunkcloud_tools(args)
\ No newline at end of file